@@ -0,0 +1,168 @@
+"""
+Admission control
+Expensive endpoints are grouped into classes (chat, image, video, export).
+For each class the middleware keeps an EWMA of the service time, the number
+of requests in flight and how many it can run at once. A new request would
+wait roughly
+    (in flight - concurrency + 1) / concurrency * service time
+before it starts. If that wait exceeds the class deadline, the request is
+refused straight away with 429 and a Retry-After, instead of queueing until
+the client times out and throwing away the work already done on it.
+
+Requests that don't fall into a class (auth, history, search, static files,
+pages, metrics, admin) are always admitted, so the site stays usable while
+generation is being shed.
+
+Service time is only sampled from successful requests that started with a
+free slot, so queueing delay under overload doesn't inflate the estimate.
+    ADMISSION_DEADLINES=chat=20,image=60,video=120,export=300   (seconds)
+    ADMISSION_CONCURRENCY=chat=16,export=4   (image/video use the scheduler's slots)
+"""
+
+import json
+import math
+import os
+import threading
+import time
+
+from . import metrics, scheduler
+
+
+def _class_map(value, defaults):
+    result = dict(defaults)
+    for item in value.split(","):
+        name, _, number = item.partition("=")
+        if name.strip() and number.strip():
+            result[name.strip()] = float(number)
+    return result
+
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+ADMISSION_DEADLINES = _class_map(os.getenv("ADMISSION_DEADLINES", ""),
+                                 {"chat": 20, "image": 60, "video": 120, "export": 300})
+ADMISSION_CONCURRENCY = _class_map(os.getenv("ADMISSION_CONCURRENCY", ""), {
+    "chat": 16, "image": scheduler.IMAGE_JOB_SLOTS, "video": scheduler.VIDEO_JOB_SLOTS, "export": 4,
+})
+# Starting estimates (seconds) until real requests have been measured
+INITIAL_SERVICE_TIMES = {"chat": 2.0, "image": 10.0, "video": 30.0, "export": 5.0}
+EWMA_ALPHA = 0.2
+
+# (class, method, path prefix); first match wins, unmatched requests are always admitted
+ENDPOINT_CLASSES = (
+    ("chat", "POST", "/api/chat"),
+    ("image", "POST", "/api/image/generate"),
+    ("video", "POST", "/api/video/process/"),
+    ("export", "GET", "/api/export"),
+)
+
+admission_rejections = metrics.Counter(
+    "admission_rejections_total", "Requests refused because the predicted wait exceeded the deadline", ("class",))
+
+
+def classify(method, path):
+    for name, class_method, prefix in ENDPOINT_CLASSES:
+        if method == class_method and (path == prefix or path.startswith(prefix.rstrip("/") + "/")):
+            return name
+    return None
+
+
+class EndpointClass:
+    """Load estimate for one class of endpoints"""
+
+    def __init__(self, name, deadline, concurrency, service_time):
+        self.name = name
+        self.deadline = deadline
+        self.concurrency = max(1, int(concurrency))
+        self.service_time = service_time
+        self.samples = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def predicted_wait(self, in_flight=None):
+        queued = (self.in_flight if in_flight is None else in_flight) - self.concurrency + 1
+        return max(0, queued) * self.service_time / self.concurrency
+
+    def try_admit(self):
+        """Count the request in and return (admitted, wait_if_rejected, had_free_slot)"""
+        with self._lock:
+            wait = self.predicted_wait()
+            if wait > self.deadline:
+                return False, wait, False
+            had_free_slot = self.in_flight < self.concurrency
+            self.in_flight += 1
+            return True, wait, had_free_slot
+
+    def done(self, elapsed=None):
+        with self._lock:
+            self.in_flight -= 1
+            if elapsed is not None:
+                # The first measurement replaces the configured guess outright
+                alpha = EWMA_ALPHA if self.samples else 1.0
+                self.service_time += alpha * (elapsed - self.service_time)
+                self.samples += 1
+
+    def to_dict(self):
+        return {"in_flight": self.in_flight, "concurrency": self.concurrency,
+                "service_time_s": round(self.service_time, 3), "samples": self.samples, "deadline_s": self.deadline,
+                "predicted_wait_s": round(self.predicted_wait(), 3)}
+
+
+endpoint_classes = {
+    name: EndpointClass(name, ADMISSION_DEADLINES[name], ADMISSION_CONCURRENCY[name], INITIAL_SERVICE_TIMES[name])
+    for name in INITIAL_SERVICE_TIMES
+}
+
+metrics.Gauge("admission_predicted_wait_seconds", "Predicted queueing delay for a new request",
+              lambda: {(name,): c.predicted_wait() for name, c in endpoint_classes.items()}, ["class"])
+
+
+class AdmissionMiddleware:
+    """Shed expensive requests early when they could not start before their deadline"""
+
+    def __init__(self, app, classes=None):
+        self.app = app
+        self.classes = endpoint_classes if classes is None else classes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_CONTROL:
+            await self.app(scope, receive, send)
+            return
+        name = classify(scope["method"], scope["path"])
+        endpoint_class = self.classes.get(name) if name else None
+        if endpoint_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        admitted, wait, had_free_slot = endpoint_class.try_admit()
+        if not admitted:
+            admission_rejections.inc(name)
+            retry_after = max(1, math.ceil(wait - endpoint_class.deadline))
+            await self._reject(send, name, retry_after)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        elapsed = None
+        try:
+            await self.app(scope, receive, send_with_status)
+            if had_free_slot and status_code < 400:
+                elapsed = time.perf_counter() - started
+        finally:
+            endpoint_class.done(elapsed)
+
+    async def _reject(self, send, name, retry_after):
+        body = json.dumps({"detail": f"The server is too busy to start this {name} request in time, "
+                                     f"please retry in {retry_after}s"}).encode("utf-8")
+        await send({"type": "http.response.start", "status": 429, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", str(retry_after).encode("latin-1")),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -1,19 +1,232 @@
+import asyncio
+import hmac
+import ipaddress
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import os
+import threading
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from passlib.hash import pbkdf2_sha256
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from . import models, schemas, database
+from sqlalchemy import event, select
+from sqlalchemy.orm import make_transient_to_detached
+from . import models, schemas, database, metrics, tracing
 
 # CONFIGURATION
 SECRET_KEY = "PLEASE_CHANGE_THIS_IN_PRODUCTION_TO_A_VERY_SECURE_SECRET_KEY"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Verified-token cache (seconds; 0 disables). Other workers see user changes after at most one TTL.
+USER_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+
+# Password hashing runs on its own small pool so a login burst cannot starve request threads
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+# Cost is calibrated at startup to roughly this many milliseconds per hash
+PASSWORD_HASH_TARGET_MS = float(os.getenv("PASSWORD_HASH_TARGET_MS", "50"))
+# Never go below passlib's own default, whatever the calibration says
+PASSWORD_MIN_ROUNDS = pbkdf2_sha256.default_rounds
+# Calibrated rounds are rounded to this step so restarts and same-sized dynos agree
+PASSWORD_ROUNDS_STEP = 10000
+
+# Login throttling: failures allowed per window, per account and per client IP
+LOGIN_WINDOW_SECONDS = int(os.getenv("LOGIN_WINDOW_SECONDS", "900"))
+LOGIN_MAX_FAILURES_PER_ACCOUNT = int(os.getenv("LOGIN_MAX_FAILURES_PER_ACCOUNT", "5"))
+LOGIN_MAX_FAILURES_PER_IP = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "30"))
+REGISTER_MAX_PER_IP = int(os.getenv("REGISTER_MAX_PER_IP", "10"))
+
+# Reverse proxies whose X-Forwarded-For is believed (IPs or CIDRs, "*" for any).
+# uvicorn's --forwarded-allow-ips reads the same variable
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Comma-separated usernames allowed to use /api/admin
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+# Bearer token for Prometheus scrapes of /metrics (admins can use their own token too)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+logger = logging.getLogger(__name__)
+
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_pending = 0
+_hash_pending_lock = threading.Lock()
+metrics.Gauge("password_hash_queue_depth", "Password hash jobs running or waiting", lambda: _hash_pending)
+
+
+def _time_hash(rounds):
+    """Best of three timings, in seconds, of one pbkdf2 hash with this many rounds"""
+    hasher = pbkdf2_sha256.using(rounds=rounds)
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        hasher.hash("calibration")
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def calibrate_password_cost(target_ms=PASSWORD_HASH_TARGET_MS):
+    """Pick pbkdf2 rounds that take about target_ms on this machine and install them
+
+    New hashes use the calibrated rounds. Existing hashes are only upgraded on
+    login when they have fewer than half as many, so timing noise between
+    restarts never makes every login pay for a rehash.
+    """
+    global pwd_context
+    sample_rounds = PASSWORD_MIN_ROUNDS
+    measured = int(sample_rounds * (target_ms / 1000) / _time_hash(sample_rounds))
+    rounds = max(PASSWORD_MIN_ROUNDS, round(measured / PASSWORD_ROUNDS_STEP) * PASSWORD_ROUNDS_STEP)
+    min_rounds = max(PASSWORD_MIN_ROUNDS, rounds // 2)
+    pwd_context = CryptContext(
+        schemes=["pbkdf2_sha256"], deprecated="auto",
+        pbkdf2_sha256__default_rounds=rounds, pbkdf2_sha256__min_rounds=min_rounds,
+    )
+    logger.info(f"Password hashing calibrated to {rounds} pbkdf2 rounds (~{target_ms:.0f} ms), "
+                f"upgrading hashes below {min_rounds}")
+    return rounds
+
+
+async def _run_hash_job(func, *args):
+    """Run a hashing call on the dedicated pool, shedding load when its queue is full"""
+    global _hash_pending
+    with _hash_pending_lock:
+        if _hash_pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        _hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        with _hash_pending_lock:
+            _hash_pending -= 1
+
+
+async def hash_password_async(password):
+    """Hash a password without blocking the event loop or the request threadpool"""
+    return await _run_hash_job(get_password_hash, password)
+
+
+async def verify_password_async(plain_password, hashed_password):
+    """Verify a password off the event loop
+
+    Returns (valid, new_hash); new_hash is set when the stored hash uses outdated
+    parameters and should be replaced.
+    """
+    return await _run_hash_job(lambda: pwd_context.verify_and_update(plain_password, hashed_password))
+
+
+class LoginThrottle:
+    """Sliding-window failure counter keyed by account or client address"""
+
+    def __init__(self, window_seconds, max_keys=10000):
+        self.window = window_seconds
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        return events
+
+    def retry_after(self, key, limit):
+        """Seconds until key is allowed again, or 0 if it is under the limit"""
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if not events or len(events) < limit:
+                return 0
+            return int(events[0] + self.window - now) + 1
+
+    def record(self, key):
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if events is None:
+                events = self._events[key] = deque()
+            events.append(now)
+            self._events.move_to_end(key)
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+    def check(self, limits):
+        """Raise 429 if any (key, limit) pair is over its limit"""
+        wait = max((self.retry_after(key, limit) for key, limit in limits), default=0)
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts, please try again later",
+                headers={"Retry-After": str(wait)},
+            )
+
+
+login_throttle = LoginThrottle(LOGIN_WINDOW_SECONDS)
+register_throttle = LoginThrottle(LOGIN_WINDOW_SECONDS)
+
+
+def parse_trusted_proxies(value):
+    """'10.0.0.0/8,127.0.0.1' -> list of networks; None means every address is trusted"""
+    items = [item.strip() for item in value.split(",") if item.strip()]
+    if "*" in items:
+        return None
+    networks = []
+    for item in items:
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logger.warning(f"Ignoring invalid FORWARDED_ALLOW_IPS entry {item!r}")
+    return networks
+
+
+trusted_proxies = parse_trusted_proxies(FORWARDED_ALLOW_IPS)
+
+
+def _is_trusted_proxy(host):
+    if trusted_proxies is None:
+        return True
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted_proxies)
+
+
+def client_ip(request):
+    """Address of the client a request came from, for per-IP throttling
+
+    Behind trusted proxies this is the nearest X-Forwarded-For hop that isn't
+    itself a trusted proxy; entries further left are client-supplied and
+    can't be believed.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(peer):
+        return peer
+    hops = [hop.strip() for hop in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -34,21 +247,126 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+class PrincipalCache:
+    """Bounded LRU of verified tokens -> user column values, with per-entry expiry"""
+
+    FIELDS = ("id", "username", "email", "hashed_password", "created_at")
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, values = entry
+            if expires_at <= time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return values
+
+    def put(self, token, user, token_exp=None):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        ttl = self.ttl
+        if token_exp is not None:
+            # Never serve a token from cache past its own expiry
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0:
+            return
+        values = {field: getattr(user, field) for field in self.FIELDS}
+        with self._lock:
+            self._entries[token] = (time.monotonic() + ttl, values)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            stale = [t for t, (_, values) in self._entries.items() if values["id"] == user_id]
+            for token in stale:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+
+def _detached_user(values):
+    """Turn cached column values into a User without a session or a query"""
+    user = models.User(**values)
+    make_transient_to_detached(user)
+    return user
+
+
+async def _load_user(token_data):
+    # A short-lived session of its own: the connection goes back to the pool
+    # before the route runs, so routes with their own (sync or async) session
+    # never hold two at once
+    async with database.AsyncSessionLocal() as db:
+        if token_data.user_id is not None:
+            # Primary-key lookup; the username check guards against reused ids
+            user = await db.get(models.User, token_data.user_id)
+            if user is not None and user.username != token_data.username:
+                user = None
+        else:
+            # Tokens issued before the uid claim existed
+            result = await db.execute(select(models.User).where(models.User.username == token_data.username))
+            user = result.scalars().first()
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """The authenticated user, detached from any session (use its id for queries)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = principal_cache.get(token)
+    if cached is not None:
+        with tracing.span("auth.cached_user"):
+            return _detached_user(cached)
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with tracing.span("auth.decode_jwt"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = schemas.TokenData(username=username)
+        token_data = schemas.TokenData(username=username, user_id=payload.get("uid"))
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
+    with tracing.span("auth.load_user"):
+        user = await _load_user(token_data)
     if user is None:
         raise credentials_exception
+    principal_cache.put(token, user, payload.get("exp"))
     return user
+
+
+async def get_current_admin(current_user: models.User = Depends(get_current_user)):
+    """Current user, if listed in ADMIN_USERS"""
+    if current_user.username not in ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+
+async def get_metrics_reader(token: str = Depends(oauth2_scheme)):
+    """Allow the METRICS_TOKEN scraper or an admin; returns the admin user, or None for the scraper"""
+    if METRICS_TOKEN and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return None
+    return await get_current_admin(await get_current_user(token))
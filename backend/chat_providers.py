@@ -0,0 +1,227 @@
+"""
+Chat providers
+The chat router talks to a ChatProvider picked by model name:
+    gemini-*              Google Gemini (async SDK calls, one GenerativeModel per model name)
+    ollama/<name>         a local Ollama server at MODEL_HOST
+    <name>                Ollama, if the server has that model (e.g. "mistral"), else Gemini's default
+Each provider keeps its HTTP connections for the life of the process: Ollama
+requests go through one pooled keep-alive httpx client (HTTP/2 when the h2
+package is installed and the server negotiates it), and the Gemini SDK reuses
+its own transport. The Ollama model list is cached for MODEL_LIST_TTL seconds.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from . import metrics, model_manager, tracing
+
+logger = logging.getLogger(__name__)
+
+MODEL_HOST = os.getenv("MODEL_HOST", "http://localhost:11434")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20"))
+MODEL_LIST_TTL = float(os.getenv("MODEL_LIST_TTL", "60"))
+
+DEFAULT_GEMINI_MODEL = "gemini-2.5-flash"
+# Models available to this API key
+GEMINI_MODELS = ["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.0-flash", "gemini-flash-latest"]
+# Legacy names that are no longer served
+GEMINI_ALIASES = {"gemini-pro": DEFAULT_GEMINI_MODEL, "gemini-1.5-flash": DEFAULT_GEMINI_MODEL}
+
+ollama_request_duration = metrics.Histogram(
+    "ollama_request_duration_seconds", "Ollama chat latency", ("model",), buckets=metrics.SLOW_BUCKETS)
+ollama_errors = metrics.Counter("ollama_errors_total", "Failed Ollama calls", ("model",))
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def is_unspecified(model):
+    """True when the client didn't really pick a model ("string" is the Swagger UI placeholder)"""
+    model = (model or "").strip()
+    return not model or model.lower() == "string"
+
+
+class ChatProvider:
+    """A backend that can answer a chat prompt"""
+
+    name = None
+
+    async def generate(self, model, prompt):
+        raise NotImplementedError
+
+    async def list_models(self):
+        return []
+
+    async def aclose(self):
+        pass
+
+
+class GeminiProvider(ChatProvider):
+    name = "gemini"
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self):
+        return bool(os.getenv("GEMINI_API_KEY"))
+
+    def handles(self, model):
+        return model.startswith("gemini")
+
+    def resolve_name(self, model):
+        return GEMINI_ALIASES.get(model, model)
+
+    def _model(self, model):
+        with self._lock:
+            instance = self._models.get(model)
+            if instance is None:
+                import google.generativeai as genai
+                # Configures the SDK on first use (raises ValueError without an API key)
+                model_manager.load_gemini_model()
+                instance = self._models[model] = genai.GenerativeModel(model)
+            return instance
+
+    async def generate(self, model, prompt):
+        instance = self._model(model)
+        try:
+            with metrics.gemini_request_duration.time(model), tracing.span("gemini.generate_content", model=model):
+                response = await instance.generate_content_async(prompt)
+                return response.text
+        except Exception:
+            metrics.gemini_errors.inc(model)
+            raise
+
+    async def list_models(self):
+        return list(GEMINI_MODELS) if self.configured else []
+
+
+class OllamaProvider(ChatProvider):
+    name = "ollama"
+
+    def __init__(self, host=MODEL_HOST, timeout=OLLAMA_TIMEOUT, max_connections=OLLAMA_MAX_CONNECTIONS,
+                 model_list_ttl=MODEL_LIST_TTL):
+        self.host = host.rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.model_list_ttl = model_list_ttl
+        self._client = None
+        self._sync_client = None
+        self._models = None
+        self._models_expire = 0.0
+        self._models_lock = None
+
+    def _limits(self):
+        import httpx
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections, keepalive_expiry=60)
+
+    @property
+    def client(self):
+        """Shared async client; connections are kept alive between requests"""
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(base_url=self.host, http2=HTTP2_AVAILABLE, limits=self._limits(),
+                                             timeout=httpx.Timeout(self.timeout, connect=5.0))
+        return self._client
+
+    def ping(self):
+        """Blocking reachability check for sync callers (shares one pooled client too)"""
+        import httpx
+        if self._sync_client is None:
+            self._sync_client = httpx.Client(base_url=self.host, limits=self._limits(), timeout=2.0)
+        try:
+            return self._sync_client.get("/api/tags").status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def list_models(self):
+        """Model names on the server, cached for model_list_ttl seconds ([] when unreachable)"""
+        if self._models is not None and time.monotonic() < self._models_expire:
+            return self._models
+        if self._models_lock is None:
+            self._models_lock = asyncio.Lock()
+        async with self._models_lock:
+            # Another request may have refreshed the list while we waited
+            if self._models is not None and time.monotonic() < self._models_expire:
+                return self._models
+            import httpx
+            try:
+                response = await self.client.get("/api/tags", timeout=5.0)
+                response.raise_for_status()
+                models = [m["name"] for m in response.json().get("models", [])]
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                logger.warning(f"Could not fetch Ollama models from {self.host}: {e}")
+                models = []
+            self._models = models
+            self._models_expire = time.monotonic() + self.model_list_ttl
+            return models
+
+    async def has_model(self, model):
+        models = await self.list_models()
+        return model in models or f"{model}:latest" in models
+
+    async def generate(self, model, prompt):
+        payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": False}
+        try:
+            with ollama_request_duration.time(model), tracing.span("ollama.chat", model=model):
+                response = await self.client.post("/api/chat", json=payload)
+                response.raise_for_status()
+                return response.json()["message"]["content"]
+        except Exception:
+            ollama_errors.inc(model)
+            raise
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+
+class ChatProviders:
+    """Routes a requested model name to a provider"""
+
+    def __init__(self, gemini, ollama):
+        self.gemini = gemini
+        self.ollama = ollama
+
+    async def resolve(self, model):
+        """(provider, model name to send it) for a ChatRequest.model value"""
+        if is_unspecified(model):
+            return self.gemini, DEFAULT_GEMINI_MODEL
+        model = model.strip()
+        if model.startswith("ollama/"):
+            return self.ollama, model[len("ollama/"):]
+        if self.gemini.handles(model):
+            return self.gemini, self.gemini.resolve_name(model)
+        if await self.ollama.has_model(model):
+            return self.ollama, model
+        # Local model requested but not served here: answer with Gemini rather than fail
+        return self.gemini, DEFAULT_GEMINI_MODEL
+
+    def get(self, name):
+        return {"gemini": self.gemini, "ollama": self.ollama}[name]
+
+    async def list_models(self):
+        gemini_models, ollama_models = await asyncio.gather(self.gemini.list_models(), self.ollama.list_models())
+        return {"gemini": gemini_models, "ollama": ollama_models}
+
+    async def aclose(self):
+        await self.gemini.aclose()
+        await self.ollama.aclose()
+
+
+gemini = GeminiProvider()
+ollama = OllamaProvider()
+providers = ChatProviders(gemini, ollama)
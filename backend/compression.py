@@ -0,0 +1,134 @@
+"""
+Response compression for API routes
+Brotli when the client accepts it and the brotli package is installed,
+gzip otherwise. Static files are left alone: they carry precompressed
+variants (see static_files.py) and media is already compressed.
+"""
+
+import asyncio
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent as-is; compression would not pay for the CPU
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSED_PATH_PREFIXES = ("/api/",)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+# Larger chunks are compressed in a worker thread instead of on the event loop
+THREAD_MIN_SIZE = 256 * 1024
+
+SKIP_CONTENT_TYPES = ("application/zip", "application/gzip", "text/event-stream")
+SKIP_CONTENT_PREFIXES = ("image/", "video/", "audio/")
+
+
+def choose_encoding(accept_encoding):
+    """Pick br or gzip from an Accept-Encoding header value, or None"""
+    accepted = set()
+    for token in accept_encoding.split(","):
+        coding, _, params = token.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, final):
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + self._brotli.finish() if final else out
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush() if final else out
+
+
+class CompressionMiddleware:
+    """Compress API responses above a size threshold, streaming responses included"""
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE, path_prefixes=COMPRESSED_PATH_PREFIXES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.path_prefixes = path_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+        accept = b""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value
+        encoding = choose_encoding(accept.decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def compress(data, final):
+            if len(data) >= THREAD_MIN_SIZE:
+                return await asyncio.to_thread(compressor.compress, data, final)
+            return compressor.compress(data, final)
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = {k.lower(): v for k, v in message["headers"]}
+                content_type = headers.get(b"content-type", b"").decode("latin-1").partition(";")[0].strip()
+                passthrough = (
+                    b"content-encoding" in headers
+                    or message["status"] in (204, 206, 304)
+                    or content_type in SKIP_CONTENT_TYPES
+                    or content_type.startswith(SKIP_CONTENT_PREFIXES)
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    # Held back until the first body chunk shows whether to compress
+                    start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                if compressor is None and not more_body and len(body) < self.minimum_size:
+                    await send(start)
+                    await send(message)
+                    start = None
+                    passthrough = True
+                    return
+                compressor = _Compressor(encoding)
+                vary = [v for k, v in start["headers"] if k.lower() == b"vary"]
+                headers = [(k, v) for k, v in start["headers"] if k.lower() not in (b"content-length", b"vary")]
+                headers += [(b"content-encoding", encoding.encode()),
+                            (b"vary", b", ".join(vary + [b"Accept-Encoding"]))]
+                body = await compress(body, final=not more_body)
+                if not more_body:
+                    headers.append((b"content-length", str(len(body)).encode()))
+                await send({**start, "headers": headers})
+                start = None
+            else:
+                body = await compress(body, final=not more_body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
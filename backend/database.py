@@ -1,21 +1,167 @@
-from sqlalchemy import create_engine
+import os
+import time
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-# Database URL (SQLite)
-SQLALCHEMY_DATABASE_URL = "sqlite:///./final_year_project.db"
+from . import metrics, tracing
+
+# Database URL (SQLite by default; set DATABASE_URL for PostgreSQL)
+DEFAULT_DATABASE_URL = "sqlite:///./final_year_project.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL)
+# Optional replica / second connection pool for read-heavy endpoints such as history
+SQLALCHEMY_READ_DATABASE_URL = os.getenv("DATABASE_READ_URL")
+
+# Pool settings for server databases (ignored for SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Applied to every new SQLite connection. WAL lets readers run alongside a writer,
+# and NORMAL sync is safe under WAL (a crash can only lose the last commits).
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,          # ms to wait on a locked database instead of failing
+    "mmap_size": 268435456,        # 256 MB of memory-mapped reads
+    "cache_size": -65536,          # 64 MB page cache (negative = KiB)
+    "temp_store": "MEMORY",
+}
+
+
+def normalize_database_url(url):
+    """Accept the postgres:// scheme some hosts (Render, Heroku) hand out"""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def async_database_url(url):
+    """Map a sync database URL to its asyncio driver (aiosqlite / asyncpg)"""
+    url = normalize_database_url(url)
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    driver = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}.get(dialect, scheme)
+    return f"{driver}{sep}{rest}"
+
+
+def _install_sqlite_pragmas(sync_engine, pragmas):
+    @event.listens_for(sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def _server_pool_options(url, read_only):
+    execution_options = {"postgresql_readonly": True} if read_only and url.startswith("postgresql") else {}
+    return dict(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        execution_options=execution_options,
+    )
+
+
+def create_db_engine(url, read_only=False, sqlite_pragmas=SQLITE_PRAGMAS):
+    """Create an engine with per-backend tuning"""
+    url = normalize_database_url(url)
+    if url.startswith("sqlite"):
+        db_engine = create_engine(url, connect_args={"check_same_thread": False})
+        pragmas = dict(sqlite_pragmas)
+        if read_only:
+            pragmas["query_only"] = "ON"
+        _install_sqlite_pragmas(db_engine, pragmas)
+        return db_engine
+
+    return create_engine(url, **_server_pool_options(url, read_only))
+
+
+def create_async_db_engine(url, read_only=False, sqlite_pragmas=SQLITE_PRAGMAS):
+    """Async counterpart of create_db_engine, with the same tuning"""
+    url = async_database_url(url)
+    if url.startswith("sqlite"):
+        db_engine = create_async_engine(url)
+        pragmas = dict(sqlite_pragmas)
+        if read_only:
+            pragmas["query_only"] = "ON"
+        _install_sqlite_pragmas(db_engine.sync_engine, pragmas)
+        return db_engine
+
+    return create_async_engine(url, **_server_pool_options(url, read_only))
+
 
 # Engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+tracing.instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Read-only engine; shares the primary engine unless DATABASE_READ_URL is set
+if SQLALCHEMY_READ_DATABASE_URL:
+    read_engine = create_db_engine(SQLALCHEMY_READ_DATABASE_URL, read_only=True)
+    tracing.instrument_engine(read_engine)
+else:
+    read_engine = engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Async engine for async endpoints, so their queries never block the event loop.
+# expire_on_commit=False: attributes stay readable after commit without an implicit (sync) refresh.
+async_engine = create_async_db_engine(SQLALCHEMY_DATABASE_URL)
+tracing.instrument_engine(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
     db = SessionLocal()
+    started = time.perf_counter()
     try:
         yield db
     finally:
         db.close()
+        metrics.db_session_duration.observe(time.perf_counter() - started, "write")
+
+def get_read_db():
+    db = ReadSessionLocal()
+    started = time.perf_counter()
+    try:
+        yield db
+    finally:
+        db.close()
+        metrics.db_session_duration.observe(time.perf_counter() - started, "read")
+
+async def get_async_db():
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            yield db
+    finally:
+        metrics.db_session_duration.observe(time.perf_counter() - started, "async")
+
+def add_missing_columns(bind=None):
+    """Add model columns that are missing from existing tables
+
+    create_all() only creates new tables, and there is no migration tool, so
+    columns added to models later are appended here with ALTER TABLE.
+    """
+    bind = bind or engine
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
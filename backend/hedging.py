@@ -0,0 +1,212 @@
+"""
+Hedged chat requests and latency-based routing
+With CHAT_HEDGING on, a chat call that hasn't answered after the primary
+model's recent p95 latency (CHAT_HEDGE_PERCENTILE) gets a backup request to
+another candidate model; whichever answers first wins and the other call is
+cancelled. A primary that fails early fails over to a backup straight away.
+Hedges are capped at CHAT_HEDGE_BUDGET of requests so a slow provider can't
+double the load on everything else.
+
+Every completed call feeds per-model stats (recent latencies, EWMA latency
+and error rate). A cancelled call never counts as a latency sample: a
+primary that lost the race only tells us it took at least that long, which
+is kept for its hedge-delay percentile, and a cancelled backup is ignored.
+
+Backups are drawn from CHAT_HEDGE_CANDIDATES with weight
+(1 - error rate) / latency. Chat requests that don't name a model (no
+`model` field, or an empty one) use the same weights to pick their primary;
+an explicit model, including "mistral", is always sent to that model first.
+    CHAT_HEDGE_CANDIDATES=gemini/gemini-2.5-flash,gemini/gemini-2.0-flash,ollama/mistral
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from . import chat_providers, metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+CHAT_HEDGING = os.getenv("CHAT_HEDGING", "false").lower() in ("1", "true", "yes")
+CHAT_HEDGE_CANDIDATES = os.getenv("CHAT_HEDGE_CANDIDATES", "gemini/gemini-2.5-flash,gemini/gemini-2.0-flash")
+CHAT_HEDGE_PERCENTILE = float(os.getenv("CHAT_HEDGE_PERCENTILE", "95"))
+# Used until a model has enough samples for a percentile
+CHAT_HEDGE_DELAY_MS = float(os.getenv("CHAT_HEDGE_DELAY_MS", "2000"))
+CHAT_HEDGE_MIN_DELAY_MS = float(os.getenv("CHAT_HEDGE_MIN_DELAY_MS", "200"))
+CHAT_HEDGE_MAX_DELAY_MS = float(os.getenv("CHAT_HEDGE_MAX_DELAY_MS", "10000"))
+# At most this fraction of requests may send a backup
+CHAT_HEDGE_BUDGET = float(os.getenv("CHAT_HEDGE_BUDGET", "0.1"))
+MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+EWMA_ALPHA = 0.1
+
+chat_hedges = metrics.Counter("chat_hedged_requests_total", "Chat calls that sent a backup request", ("winner",))
+
+
+class ModelStats:
+    """Recent latency and error rate of one provider/model"""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        # Lower bounds from primaries cancelled after a backup won
+        self.censored = deque(maxlen=LATENCY_WINDOW)
+        self.ewma_latency = None
+        self.error_rate = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, ok=True):
+        with self._lock:
+            self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+            if not ok:
+                return  # failures are often instant and would make a broken model look fast
+            self.latencies.append(seconds)
+            self.ewma_latency = seconds if self.ewma_latency is None else \
+                self.ewma_latency + EWMA_ALPHA * (seconds - self.ewma_latency)
+
+    def observe_censored(self, seconds):
+        """A call that was cancelled after `seconds` would have taken at least that long"""
+        with self._lock:
+            self.censored.append(seconds)
+
+    def percentile(self, pct):
+        with self._lock:
+            if len(self.latencies) + len(self.censored) < MIN_SAMPLES:
+                return None
+            ordered = sorted(itertools.chain(self.latencies, self.censored))
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def weight(self, default_latency):
+        """Higher is better; a model without successful calls yet is assumed to be average"""
+        latency = default_latency if self.ewma_latency is None else self.ewma_latency
+        return max(1.0 - self.error_rate, 0.01) / max(latency, 0.01)
+
+    def to_dict(self):
+        return {"samples": len(self.latencies), "censored": len(self.censored), "ewma_latency_s": self.ewma_latency,
+                "error_rate": round(self.error_rate, 4), "p95_s": self.percentile(95)}
+
+
+def _consume(task):
+    # A cancelled or failed loser must not log "exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+class HedgingRouter:
+    def __init__(self, providers, candidates, percentile=CHAT_HEDGE_PERCENTILE, budget=CHAT_HEDGE_BUDGET,
+                 default_delay=CHAT_HEDGE_DELAY_MS / 1000, min_delay=CHAT_HEDGE_MIN_DELAY_MS / 1000,
+                 max_delay=CHAT_HEDGE_MAX_DELAY_MS / 1000):
+        self.providers = providers
+        self.candidates = [tuple(c.strip().split("/", 1)) for c in candidates if "/" in c]
+        self.percentile = percentile
+        self.budget = budget
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stats = {}
+        # Token bucket: each request earns `budget` tokens, a hedge spends one
+        self._tokens = 1.0
+        self._lock = threading.Lock()
+
+    def stats_for(self, provider_name, model):
+        key = (provider_name, model)
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = ModelStats()
+            return stats
+
+    def hedge_delay(self, provider_name, model):
+        observed = self.stats_for(provider_name, model).percentile(self.percentile)
+        delay = self.default_delay if observed is None else observed
+        return min(max(delay, self.min_delay), self.max_delay)
+
+    def pick(self, exclude=None):
+        """Weighted random candidate (provider name, model), favouring fast and reliable models"""
+        options = [c for c in self.candidates if c != exclude]
+        if not options:
+            return None
+        stats = [self.stats_for(*c) for c in options]
+        known = [s.ewma_latency for s in stats if s.ewma_latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        return random.choices(options, [s.weight(default_latency) for s in stats])[0]
+
+    def _earn_hedge_token(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.budget, 10.0)
+
+    def _spend_hedge_token(self):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    async def _call(self, provider_name, model, prompt, primary=True):
+        provider = self.providers.get(provider_name)
+        stats = self.stats_for(provider_name, model)
+        started = time.perf_counter()
+        try:
+            text = await provider.generate(model, prompt)
+        except asyncio.CancelledError:
+            # A cancelled backup was cut short at an arbitrary point and says nothing
+            if primary:
+                stats.observe_censored(time.perf_counter() - started)
+            raise
+        except Exception:
+            stats.observe(time.perf_counter() - started, ok=False)
+            raise
+        stats.observe(time.perf_counter() - started, ok=True)
+        return text
+
+    async def generate(self, provider_name, model, prompt, choose_primary=False):
+        """Answer from the primary, or from a backup if the primary is slow or failing"""
+        primary_key = (provider_name, model)
+        if choose_primary:
+            primary_key = self.pick() or primary_key
+        self._earn_hedge_token()
+        delay = self.hedge_delay(*primary_key)
+        primary = asyncio.ensure_future(self._call(*primary_key, prompt))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done and primary.exception() is None:
+                return primary.result()
+
+            backup_key = self.pick(exclude=primary_key)
+            # A failed primary always fails over; a slow one only hedges within the budget
+            if backup_key is None or (not done and not self._spend_hedge_token()):
+                return await primary
+            with tracing.span("chat.hedge", primary=f"{primary_key[0]}/{primary_key[1]}",
+                              backup=f"{backup_key[0]}/{backup_key[1]}", delay_ms=round(delay * 1000)):
+                backup = asyncio.ensure_future(self._call(*backup_key, prompt, primary=False))
+                tasks.append(backup)
+                pending = {backup} if done else {primary, backup}
+                first_error = primary.exception() if done else None
+                while pending:
+                    finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in finished:
+                        if task.exception() is None:
+                            chat_hedges.inc("primary" if task is primary else "backup")
+                            return task.result()
+                        first_error = first_error or task.exception()
+                chat_hedges.inc("none")
+                raise first_error
+        finally:
+            # The loser (or everything, if our caller was cancelled) is abandoned
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    task.add_done_callback(_consume)
+
+    def to_dict(self):
+        with self._lock:
+            items = list(self.stats.items())
+        return {f"{p}/{m}": s.to_dict() for (p, m), s in items}
+
+
+router = HedgingRouter(chat_providers.providers, CHAT_HEDGE_CANDIDATES.split(","))
@@ -0,0 +1,89 @@
+"""
+Encoding of generated images
+Images are written atomically (temp file + rename) in the requested format,
+and smaller thumbnail variants are derived from the saved image afterwards.
+"""
+
+import logging
+import os
+import uuid
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Pillow format name, file extension and default quality per output format
+IMAGE_FORMATS = {
+    "webp": {"format": "WEBP", "ext": ".webp", "quality": 82},
+    "avif": {"format": "AVIF", "ext": ".avif", "quality": 60},
+    "jpeg": {"format": "JPEG", "ext": ".jpg", "quality": 85},
+    "png": {"format": "PNG", "ext": ".png", "quality": None},
+}
+DEFAULT_FORMAT = os.getenv("IMAGE_FORMAT", "webp")
+
+# Widths of the thumbnail variants generated for each image
+THUMBNAIL_WIDTHS = (128, 256)
+
+
+def supported_formats():
+    """Output formats the installed Pillow can actually write"""
+    Image.init()
+    return [name for name, spec in IMAGE_FORMATS.items() if spec["format"] in Image.SAVE]
+
+
+def get_format(name):
+    """Look up an output format, raising ValueError for unknown or unavailable ones"""
+    if name not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format '{name}'. Available: {', '.join(IMAGE_FORMATS)}")
+    if name not in supported_formats():
+        raise ValueError(f"Image format '{name}' is not supported by this server's Pillow build")
+    return IMAGE_FORMATS[name]
+
+
+def _save_options(name, quality):
+    spec = IMAGE_FORMATS[name]
+    quality = quality or spec["quality"]
+    if name == "webp":
+        return {"quality": quality, "method": 4}
+    if name == "avif":
+        return {"quality": quality, "speed": 8}
+    if name == "jpeg":
+        return {"quality": quality, "progressive": True, "optimize": True}
+    return {"optimize": True}
+
+
+def save_image(image, path, name=DEFAULT_FORMAT, quality=None):
+    """Encode image to path atomically, so readers never see a partial file"""
+    spec = get_format(name)
+    if name == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        image.save(tmp_path, format=spec["format"], **_save_options(name, quality))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def variant_path(path, width):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_{width}w{ext}"
+
+
+def variant_paths(path, image_width=None):
+    """Thumbnail paths for an image, smallest first (only widths below the original)"""
+    return [(w, variant_path(path, w)) for w in THUMBNAIL_WIDTHS if image_width is None or w < image_width]
+
+
+def make_variants(path, name=DEFAULT_FORMAT, quality=None):
+    """Write the thumbnail variants of a saved image (run as a background task)"""
+    try:
+        with Image.open(path) as source:
+            source.load()
+            for width, thumb_path in variant_paths(path, source.width):
+                height = max(1, round(source.height * width / source.width))
+                save_image(source.resize((width, height), Image.LANCZOS), thumb_path, name, quality)
+    except Exception as e:
+        logger.error(f"Thumbnail generation failed for {path}: {e}")
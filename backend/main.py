@@ -1,7 +1,6 @@
 from fastapi import FastAPI, Depends, WebSocket, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 import logging
 import os
 from pathlib import Path
@@ -12,26 +11,65 @@ env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(env_path)
 
 # Now import backend modules that might rely on env vars
-from backend.database import engine, Base
-from backend.routers import auth, chat, image, video
-from backend import model_manager
+from backend.database import engine, Base, add_missing_columns
+from backend.routers import admin, auth, chat, export, image, video
+from backend import admission, chat_providers, metrics, model_manager, retention, search, tracing, video_cache, auth as auth_core
+import asyncio
+from backend.static_files import MediaStaticFiles, precompress
+from backend.compression import CompressionMiddleware
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize DB tables
-Base.metadata.create_all(bind=engine)
+# Skip model warm-up; torch/diffusers/Gemini then load on first use
+FAST_START = os.getenv("FAST_START", "false").lower() in ("1", "true", "yes")
+
+
+def init_db():
+    """Create tables, add new columns and set up the search index"""
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    search.setup_search_index(engine)
 
 app = FastAPI(title="AI Web App - Final Year Project")
+app.add_middleware(CompressionMiddleware)
+# Sheds expensive requests before any work is done; inside tracing/metrics so rejections are recorded
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+# Outermost, so request latency includes compression
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Initialize models on startup
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting up application...")
-    model_manager.initialize_models()
+    init_db()
+    auth_core.calibrate_password_cost()
+    try:
+        precompress(static_files.directory)
+    except OSError as e:
+        # Read-only image or mount: serve uncompressed (or build-time variants) instead of failing
+        logger.warning(f"Could not write precompressed static assets ({e}); "
+                       f"run 'python -m backend.static_files --compress' at build time")
+    if not FAST_START:
+        # Warm models in the background; requests are served meanwhile and
+        # anything that needs a model before it is ready loads it itself
+        app.state.warmup_task = asyncio.create_task(asyncio.to_thread(model_manager.initialize_models))
+    if retention.CHAT_RETENTION_DAYS > 0 and retention.CHAT_RETENTION_INTERVAL_HOURS > 0:
+        app.state.retention_task = asyncio.create_task(retention.run_periodically())
+    if video_cache.PREVIEW_TTL_HOURS > 0:
+        app.state.preview_sweep_task = asyncio.create_task(video_cache.sweep_previews_periodically())
     logger.info("Startup complete")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    for name in ("retention_task", "preview_sweep_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    await chat_providers.providers.aclose()
+
 # Global Exception Handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -45,15 +83,25 @@ async def global_exception_handler(request: Request, exc: Exception):
 from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
-app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
+static_files = MediaStaticFiles(directory=str(BASE_DIR / "static"))
+app.mount("/static", static_files, name="static")
+# {{ static_url('css/styles.css') }} -> /static/css/styles.css?v=<content hash>
+templates.env.globals["static_url"] = static_files.static_url
 
 # Mount API Routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
+app.include_router(export.router, prefix="/api/export", tags=["export"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 # Note: Image and Video routers will be included but may require external tools (Ollama/FFmpeg/Diffusers)
 app.include_router(image.router, prefix="/api/image", tags=["image"])
 app.include_router(video.router, prefix="/api/video", tags=["video"])
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(reader=Depends(auth_core.get_metrics_reader)):
+    """Prometheus scrape endpoint (METRICS_TOKEN bearer token or an admin's token)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Frontend Routes
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -0,0 +1,199 @@
+"""
+Prometheus metrics
+A small in-process registry rendered in the text exposition format at
+/metrics. Recording is a dict lookup, a bisect and a few additions under a
+per-metric lock, cheap enough to leave on in production.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; tuned for HTTP handlers and DB sessions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Seconds; upstream model calls and media jobs
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items()]
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', le)])} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time (no cost on the hot path)
+
+    The callback returns a number, or a dict of label-value tuples to numbers.
+    """
+
+    def __init__(self, name, documentation, func, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        value = self.func()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}")
+        return lines
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics recorded across the app
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status"))
+gemini_request_duration = Histogram(
+    "gemini_request_duration_seconds", "Gemini generate_content latency", ("model",), buckets=SLOW_BUCKETS)
+gemini_errors = Counter("gemini_errors_total", "Failed Gemini calls", ("model",))
+diffusion_inference_duration = Histogram(
+    "diffusion_inference_seconds", "Stable Diffusion pipeline call time", ("steps", "device"), buckets=SLOW_BUCKETS)
+ffmpeg_job_duration = Histogram(
+    "ffmpeg_job_duration_seconds", "ffmpeg process wall time", ("mode",), buckets=SLOW_BUCKETS)
+ffmpeg_failures = Counter("ffmpeg_failures_total", "ffmpeg processes that exited non-zero")
+db_session_duration = Histogram(
+    "db_session_duration_seconds", "Time a request held a database session", ("kind",))
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+Gauge("http_requests_in_flight", "Requests currently being handled", lambda: _in_flight)
+
+
+def _route_label(scope):
+    """Route template for the request, e.g. /api/video/process/{task_id}
+
+    Rebuilt from the path and its matched parameters, since routes included
+    with a prefix don't carry the full template on every FastAPI version.
+    """
+    if scope.get("route") is None:
+        # Mounted apps (static files) don't set a route; fold them into their mount prefix
+        root_path = scope.get("root_path", "")
+        return root_path + "/{path}" if root_path else "unmatched"
+    params = {str(v): k for k, v in scope.get("path_params", {}).items()}
+    if not params:
+        return scope["path"]
+    return "/".join("{" + params[s] + "}" if s in params else s for s in scope["path"].split("/"))
+
+
+class MetricsMiddleware:
+    """Record per-route request latency; labels use the route template, never the raw path"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        global _in_flight
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with _in_flight_lock:
+            _in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            with _in_flight_lock:
+                _in_flight -= 1
+            http_request_duration.observe(time.perf_counter() - started,
+                                          scope["method"], _route_label(scope), str(status_code))
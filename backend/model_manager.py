@@ -7,6 +7,7 @@ Supports both Gemini API and local models
 from pathlib import Path
 import logging
 import os
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +15,8 @@ logger = logging.getLogger(__name__)
 _stable_diffusion_pipeline = None
 _gemini_model = None
 _is_initialized = False
+# Background warm-up and the first request may both try to load a model
+_load_lock = threading.RLock()
 
 
 def initialize_models():
@@ -44,6 +47,11 @@ def initialize_models():
 
 def load_gemini_model():
     """Load Google Gemini API"""
+    with _load_lock:
+        return _load_gemini_model()
+
+
+def _load_gemini_model():
     global _gemini_model
     
     if _gemini_model is not None:
@@ -82,6 +90,11 @@ def get_gemini_model():
 
 def load_stable_diffusion():
     """Load Stable Diffusion with LCM for CPU optimization"""
+    with _load_lock:
+        return _load_stable_diffusion()
+
+
+def _load_stable_diffusion():
     global _stable_diffusion_pipeline
     
     if _stable_diffusion_pipeline is not None:
@@ -175,31 +188,11 @@ def get_stable_diffusion_pipeline():
 
 def check_ollama_running():
     """Check if Ollama service is running"""
-    import httpx
-    import asyncio
-    
-    try:
-        host = os.getenv("MODEL_HOST", "http://localhost:11434")
-        response = httpx.get(f"{host}/api/tags", timeout=2)
-        return response.status_code == 200
-    except:
-        return False
+    from . import chat_providers
+    return chat_providers.ollama.ping()
 
 
 async def get_available_models():
-    """Get list of available models from Ollama"""
-    import httpx
-    
-    try:
-        host = os.getenv("MODEL_HOST", "http://localhost:11434")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{host}/api/tags", timeout=5.0)
-        
-        if response.status_code == 200:
-            models = response.json().get("models", [])
-            return [m["name"] for m in models]
-        else:
-            return ["mistral"]  # Default fallback
-    except Exception as e:
-        logger.warning(f"Could not fetch Ollama models: {e}")
-        return ["mistral"]  # Default fallback
+    """Get list of available models from Ollama (cached, over the shared client)"""
+    from . import chat_providers
+    return await chat_providers.ollama.list_models() or ["mistral"]  # Default fallback
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, ForeignKey, LargeBinary, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -19,15 +19,31 @@ class User(Base):
 
 class ChatHistory(Base):
     __tablename__ = "chat_history"
+    # Never reuse ids of archived rows: archive segments and the search index are keyed by id
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     message = Column(Text, nullable=False)
     role = Column(String, nullable=False) # 'user' or 'assistant'
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
     user = relationship("User", back_populates="chats")
 
+class ChatArchive(Base):
+    """Compressed segment of old chat messages (one user, one calendar month)"""
+    __tablename__ = "chat_archive"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    month = Column(String, nullable=False) # 'YYYY-MM'
+    codec = Column(String, nullable=False) # 'zstd' or 'gzip'
+    payload = Column(LargeBinary, nullable=False) # compressed JSON list of messages
+    message_count = Column(Integer, nullable=False)
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class ImagePrompt(Base):
     __tablename__ = "image_prompts"
     
@@ -46,8 +62,20 @@ class VideoTask(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     prompt = Column(Text, nullable=False)
     source_video = Column(String, nullable=True)
+    source_hash = Column(String, index=True, nullable=True) # sha256 of the upload, used by the processing cache
     output_video = Column(String, nullable=True)
     status = Column(String, default="pending") # pending, processing, completed, failed
+    
+    # Filled in by the background step after upload
+    duration = Column(Float, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    video_codec = Column(String, nullable=True)
+    audio_codec = Column(String, nullable=True)
+    keyframe_interval = Column(Float, nullable=True)
+    proxy_video = Column(String, nullable=True)
+    thumbnail_sprite = Column(String, nullable=True)
+    thumbnail_interval = Column(Float, nullable=True) # seconds between sprite tiles
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="videos")
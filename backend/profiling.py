@@ -0,0 +1,140 @@
+"""
+Opt-in sampling profiler
+An admin picks a route template and N; every Nth request to that route is
+profiled by a thread that samples Python stacks every few milliseconds
+while the request runs. Profiles are kept in memory as folded stacks
+("frame;frame;frame count" lines), the input format of flamegraph.pl and
+speedscope.
+
+Samples cover every thread except the sampler, so an async route also picks
+up whatever else the event loop ran concurrently.
+"""
+
+import itertools
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+MAX_STACK_DEPTH = 64
+MAX_PROFILES = 20
+# Frames at the top of an idle thread's stack; such samples carry no information
+_IDLE_FUNCTIONS = {"wait", "select", "poll", "_worker", "get", "accept", "epoll"}
+
+
+class ProfilerSettings:
+    def __init__(self, route, sample_every, interval_ms):
+        self.route = route
+        self.sample_every = sample_every
+        self.interval_ms = interval_ms
+        # /api/video/process/{task_id} -> ^/api/video/process/[^/]+$
+        self.pattern = re.compile("^" + re.sub(r"\\\{[^}]+\\\}", "[^/]+", re.escape(route)) + "$")
+        self._counter = itertools.count(1)
+
+    def should_profile(self, path):
+        return bool(self.pattern.match(path)) and next(self._counter) % self.sample_every == 0
+
+    def to_dict(self):
+        return {"route": self.route, "sample_every": self.sample_every, "interval_ms": self.interval_ms}
+
+
+_settings = None
+_profiles = deque(maxlen=MAX_PROFILES)
+_profile_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+def enable(route, sample_every=10, interval_ms=5):
+    global _settings
+    _settings = ProfilerSettings(route, sample_every, interval_ms)
+    return _settings
+
+
+def disable():
+    global _settings
+    _settings = None
+
+
+def settings():
+    return _settings
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{code.co_name}:{frame.f_lineno}"
+
+
+def _folded_stack(frame):
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Collect stack samples of all other threads until stopped"""
+
+    def __init__(self, interval_ms):
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or frame.f_code.co_name in _IDLE_FUNCTIONS:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                thread_name = names.get(thread_id, str(thread_id))
+                self.samples[f"{thread_name};{_folded_stack(frame)}"] += 1
+            self.sample_count += 1
+
+
+def start_for(path):
+    """Start a profiler if this request was picked, else None"""
+    current = _settings
+    if current is None or not current.should_profile(path):
+        return None
+    return SamplingProfiler(current.interval_ms).start()
+
+
+def finish(profiler, request_id, path, duration_ms):
+    profiler.stop()
+    with _lock:
+        profile_id = next(_profile_ids)
+        _profiles.append({
+            "id": profile_id, "request_id": request_id, "path": path,
+            "duration_ms": round(duration_ms, 3), "samples": profiler.sample_count,
+            "created_at": time.time(), "folded": profiler.samples,
+        })
+    return profile_id
+
+
+def list_profiles():
+    with _lock:
+        return [{k: v for k, v in p.items() if k != "folded"} for p in _profiles]
+
+
+def folded(profile_id):
+    """Folded-stack text of a captured profile, or None"""
+    with _lock:
+        for p in _profiles:
+            if p["id"] == profile_id:
+                return "\n".join(f"{stack} {count}" for stack, count in p["folded"].most_common()) + "\n"
+    return None
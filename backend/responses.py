@@ -0,0 +1,15 @@
+"""
+orjson-backed JSON response
+For endpoints that return rows the server itself produced: returning this
+directly skips response_model validation and FastAPI's encoder.
+"""
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class OrjsonResponse(JSONResponse):
+    """JSONResponse rendered by orjson (datetimes serialize natively as ISO 8601)"""
+
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
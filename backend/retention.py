@@ -0,0 +1,272 @@
+"""
+Chat history retention
+Moves old messages out of the hot chat_history table into compressed
+per-user, per-month archive segments and reads them back when history
+pages reach that far.
+
+Run once by hand with:
+    python -m backend.retention --days 90
+"""
+
+import argparse
+import asyncio
+import gzip
+import heapq
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from . import database, models, search
+
+logger = logging.getLogger(__name__)
+
+# Messages older than this many days are archived. Archiving is opt-in:
+# unset or 0 means the periodic job is never scheduled
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "0"))
+CHAT_RETENTION_INTERVAL_HOURS = float(os.getenv("CHAT_RETENTION_INTERVAL_HOURS", "24"))
+# Rows moved per transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv("CHAT_ARCHIVE_BATCH_SIZE", "5000"))
+# Decompressed segments kept in memory for paging
+SEGMENT_CACHE_SIZE = 64
+
+try:
+    import zstandard
+except ImportError:  # optional, gzip is always available
+    zstandard = None
+
+
+def compress(data):
+    """Compress bytes with zstd when available, else gzip. Returns (codec, blob)"""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=9)
+
+
+def decompress(codec, blob):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archive segment is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    if codec == "gzip":
+        return gzip.decompress(blob)
+    raise ValueError(f"Unknown archive codec '{codec}'")
+
+
+def _message_dict(row):
+    return {"id": row.id, "role": row.role, "message": row.message,
+            "timestamp": row.timestamp.isoformat() if row.timestamp else None}
+
+
+def _encode_messages(messages):
+    return json.dumps(messages, separators=(",", ":")).encode("utf-8")
+
+
+def _write_segment(db, user_id, month, rows):
+    """Add rows to the user's segment for that month, creating it if needed
+
+    A month is archived over many runs (and batches), so an existing segment
+    is decompressed, merged with the new rows and rewritten in place. Any
+    extra segments for the same month are folded into it as well.
+    """
+    existing = (
+        db.query(models.ChatArchive)
+        .filter(models.ChatArchive.user_id == user_id, models.ChatArchive.month == month)
+        .order_by(models.ChatArchive.id)
+        .all()
+    )
+    messages = {}
+    for archive in existing:
+        for m in json.loads(decompress(archive.codec, archive.payload)):
+            messages[m["id"]] = m
+    for row in rows:
+        messages[row.id] = _message_dict(row)
+    ordered = [messages[i] for i in sorted(messages)]
+    codec, payload = compress(_encode_messages(ordered))
+
+    if existing:
+        segment = existing[0]
+        for extra in existing[1:]:
+            db.delete(extra)
+    else:
+        segment = models.ChatArchive(user_id=user_id, month=month)
+        db.add(segment)
+    segment.codec = codec
+    segment.payload = payload
+    segment.message_count = len(ordered)
+    segment.first_id = ordered[0]["id"]
+    segment.last_id = ordered[-1]["id"]
+
+
+def archive_old_chats(db, older_than_days, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move messages older than the cutoff into one compressed segment per user per month
+
+    Works in batches, one transaction each, so the hot table is never locked
+    for long. Returns the number of messages archived.
+    """
+    if older_than_days <= 0:
+        raise ValueError("older_than_days must be positive")
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = 0
+    while True:
+        rows = (
+            db.query(models.ChatHistory)
+            .filter(models.ChatHistory.timestamp < cutoff)
+            .order_by(models.ChatHistory.user_id, models.ChatHistory.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+
+        segments = OrderedDict()
+        for row in rows:
+            month = row.timestamp.strftime("%Y-%m")
+            segments.setdefault((row.user_id, month), []).append(row)
+
+        for (user_id, month), segment_rows in segments.items():
+            _write_segment(db, user_id, month, segment_rows)
+        (db.query(models.ChatHistory)
+           .filter(models.ChatHistory.id.in_([r.id for r in rows]))
+           .delete(synchronize_session=False))
+        search.keep_archived_indexed(db, rows)
+        db.commit()
+        archived += len(rows)
+        logger.info(f"Archived {len(rows)} chat messages into {len(segments)} segments")
+        if len(rows) < batch_size:
+            break
+    return archived
+
+
+class _SegmentCache:
+    """Small LRU of decompressed segments
+
+    Keyed by archive id and message count: archiving only ever adds messages
+    to a segment, so a rewritten segment gets a new key.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, archive):
+        key = (archive.id, archive.message_count)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        messages = json.loads(decompress(archive.codec, archive.payload))
+        for m in messages:
+            m["user_id"] = archive.user_id
+            m["timestamp"] = datetime.fromisoformat(m["timestamp"]) if m["timestamp"] else None
+        with self._lock:
+            self._items[key] = messages
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return messages
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+segment_cache = _SegmentCache(SEGMENT_CACHE_SIZE)
+
+
+def _row_to_dict(row):
+    return {"id": row.id, "user_id": row.user_id, "message": row.message,
+            "role": row.role, "timestamp": row.timestamp}
+
+
+def read_history(db, user_id, limit=None, before_id=None):
+    """Return a user's messages in ascending order, hot rows and archived ones alike
+
+    Without limit the whole history is returned (every segment is
+    decompressed, so only use that for one-off jobs). With limit, the newest
+    `limit` messages with id < before_id are returned; archive segments are
+    only decompressed when the page reaches past the hot table.
+    """
+    hot = db.query(models.ChatHistory).filter(models.ChatHistory.user_id == user_id)
+    if before_id is not None:
+        hot = hot.filter(models.ChatHistory.id < before_id)
+    if limit is not None:
+        hot = hot.order_by(models.ChatHistory.id.desc()).limit(limit)
+    messages = [_row_to_dict(r) for r in hot]
+    # Smallest id still on the page once it is full; older segments can't contribute
+    floor = min(m["id"] for m in messages) if limit is not None and len(messages) >= limit else None
+
+    archives = db.query(models.ChatArchive).filter(models.ChatArchive.user_id == user_id)
+    if before_id is not None:
+        archives = archives.filter(models.ChatArchive.first_id < before_id)
+    # Newest segments first, so a page stops decompressing as soon as it is full
+    for archive in archives.order_by(models.ChatArchive.last_id.desc()):
+        if floor is not None and archive.last_id < floor:
+            break
+        messages.extend(
+            m for m in segment_cache.get(archive)
+            if before_id is None or m["id"] < before_id
+        )
+        if limit is not None and len(messages) >= limit:
+            messages = heapq.nlargest(limit, messages, key=lambda m: m["id"])
+            floor = messages[-1]["id"]
+
+    messages.sort(key=lambda m: m["id"])
+    if limit is not None:
+        messages = messages[-limit:]
+    return messages
+
+
+def fill_archived_hits(db, user_id, hits):
+    """Fill in role and timestamp for search hits whose message is archived"""
+    wanted = {h["id"]: h for h in hits if h["archived"]}
+    if not wanted:
+        return hits
+    archives = db.query(models.ChatArchive).filter(
+        models.ChatArchive.user_id == user_id,
+        models.ChatArchive.first_id <= max(wanted),
+        models.ChatArchive.last_id >= min(wanted),
+    )
+    for archive in archives:
+        for m in segment_cache.get(archive):
+            hit = wanted.get(m["id"])
+            if hit is not None:
+                hit["role"], hit["timestamp"] = m["role"], m["timestamp"]
+    return hits
+
+
+def _archive_with_new_session(older_than_days):
+    db = database.SessionLocal()
+    try:
+        return archive_old_chats(db, older_than_days)
+    finally:
+        db.close()
+
+
+async def run_periodically(older_than_days=CHAT_RETENTION_DAYS, interval_hours=CHAT_RETENTION_INTERVAL_HOURS):
+    """Background loop started by the app: archive, then sleep for the interval"""
+    while True:
+        try:
+            await asyncio.to_thread(_archive_with_new_session, older_than_days)
+        except Exception as e:
+            logger.error(f"Chat retention run failed: {e}")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old chat messages")
+    parser.add_argument("--days", type=int, required=not CHAT_RETENTION_DAYS,
+                        default=CHAT_RETENTION_DAYS or None,
+                        help="archive messages older than this many days (defaults to CHAT_RETENTION_DAYS)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    database.Base.metadata.create_all(bind=database.engine)
+    database.add_missing_columns(database.engine)
+    count = _archive_with_new_session(args.days)
+    print(f"Archived {count} chat messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+from .. import models, auth, tracing, profiling, admission, hedging
+
+router = APIRouter(tags=["Admin"])
+
+
+class ProfilerRequest(BaseModel):
+    route: str  # route template, e.g. /api/chat or /api/video/process/{task_id}
+    sample_every: int = Field(10, ge=1)  # profile 1 in N matching requests
+    interval_ms: float = Field(5, ge=1, le=100)
+
+
+@router.get("/traces")
+def list_traces(limit: int = 50, admin: models.User = Depends(auth.get_current_admin)):
+    """Most recent request traces, newest first"""
+    return [trace.to_dict() for trace in tracing.recent_traces.latest(limit)]
+
+
+@router.get("/traces/{request_id}")
+def get_trace(request_id: str, admin: models.User = Depends(auth.get_current_admin)):
+    trace = tracing.recent_traces.get(request_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (it may have aged out)")
+    return trace.to_dict()
+
+
+@router.get("/admission")
+def get_admission(admin: models.User = Depends(auth.get_current_admin)):
+    """Current load estimate per endpoint class"""
+    return {"enabled": admission.ADMISSION_CONTROL,
+            "classes": {name: c.to_dict() for name, c in admission.endpoint_classes.items()}}
+
+
+@router.get("/chat-routing")
+def get_chat_routing(admin: models.User = Depends(auth.get_current_admin)):
+    """Observed latency/error stats that drive chat hedging and routing"""
+    return {"enabled": hedging.CHAT_HEDGING, "candidates": [f"{p}/{m}" for p, m in hedging.router.candidates],
+            "models": hedging.router.to_dict()}
+
+
+@router.get("/profiler")
+def get_profiler(admin: models.User = Depends(auth.get_current_admin)):
+    current = profiling.settings()
+    return {"enabled": current is not None, "settings": current.to_dict() if current else None,
+            "profiles": profiling.list_profiles()}
+
+
+@router.put("/profiler")
+def enable_profiler(request: ProfilerRequest, admin: models.User = Depends(auth.get_current_admin)):
+    """Profile 1 in sample_every requests to the route"""
+    return {"enabled": True, "settings": profiling.enable(request.route, request.sample_every, request.interval_ms).to_dict()}
+
+
+@router.delete("/profiler")
+def disable_profiler(admin: models.User = Depends(auth.get_current_admin)):
+    profiling.disable()
+    return {"enabled": False}
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: int, admin: models.User = Depends(auth.get_current_admin)):
+    """Folded stacks, ready for flamegraph.pl or speedscope"""
+    text = profiling.folded(profile_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(text)
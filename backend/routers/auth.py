@@ -1,34 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .. import schemas, models, database, auth
 from datetime import timedelta
 
 router = APIRouter(tags=["Authentication"])
 
 @router.post("/register", response_model=schemas.UserResponse)
-def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if db_user:
+async def register(user: schemas.UserCreate, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    ip_key = f"ip:{auth.client_ip(request)}"
+    auth.register_throttle.check([(ip_key, auth.REGISTER_MAX_PER_IP)])
+    auth.register_throttle.record(ip_key)
+    
+    result = await db.execute(select(models.User).where(models.User.email == user.email))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = await auth.hash_password_async(user.password)
     db_user = models.User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @router.post("/token", response_model=schemas.Token)
-def login(user_credentials: schemas.UserLogin, db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == user_credentials.email).first()
+async def login(user_credentials: schemas.UserLogin, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    # Throttle before any hashing so credential stuffing can't soak up CPU
+    account_key = f"account:{user_credentials.email.lower()}"
+    ip_key = f"ip:{auth.client_ip(request)}"
+    auth.login_throttle.check([
+        (account_key, auth.LOGIN_MAX_FAILURES_PER_ACCOUNT),
+        (ip_key, auth.LOGIN_MAX_FAILURES_PER_IP),
+    ])
+    
+    result = await db.execute(select(models.User).where(models.User.email == user_credentials.email))
+    user = result.scalars().first()
     if not user:
+        auth.login_throttle.record(account_key)
+        auth.login_throttle.record(ip_key)
         raise HTTPException(status_code=400, detail="Invalid Credentials")
     
-    if not auth.verify_password(user_credentials.password, user.hashed_password):
+    valid, new_hash = await auth.verify_password_async(user_credentials.password, user.hashed_password)
+    if not valid:
+        auth.login_throttle.record(account_key)
+        auth.login_throttle.record(ip_key)
         raise HTTPException(status_code=400, detail="Invalid Credentials")
     
+    auth.login_throttle.reset(account_key)
+    if new_hash:
+        # Stored hash predates the current cost settings; upgrade it transparently
+        user.hashed_password = new_hash
+        await db.commit()
+    
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
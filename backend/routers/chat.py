@@ -1,6 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .. import schemas, models, database, auth, model_manager
+from .. import schemas, models, database, auth, chat_providers, hedging, retention, search, tracing
+from ..responses import OrjsonResponse
+from typing import Optional
 import os
 import logging
 
@@ -10,43 +13,33 @@ router = APIRouter(tags=["Chat"])
 # Gemini configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 FALLBACK_MODEL = "gemini-pro"  # Using Gemini for chat
+HISTORY_PAGE_SIZE = 50
 
 @router.post("", response_model=schemas.ChatResponse)
 async def chat(request: schemas.ChatRequest, 
                current_user: models.User = Depends(auth.get_current_user),
-               db: Session = Depends(database.get_db)):
+               db: AsyncSession = Depends(database.get_async_db)):
     
     # Save user message
     user_msg = models.ChatHistory(user_id=current_user.id, message=request.message, role="user")
     db.add(user_msg)
-    db.commit()
+    with tracing.span("db.save_message", role="user"):
+        await db.commit()
     
-    # Call Gemini API
+    # Gemini or a local Ollama model, depending on the requested name
     try:
-        # Default model
-        model_name = "gemini-2.5-flash"
-        
-        # Check if user requested a specific valid model
-        if request.model and request.model.lower() != "string" and "llama" not in request.model.lower():
-             model_name = request.model
-             
-        # Map legacy/unavailable models to valid ones for this key
-        if model_name in ["gemini-pro", "gemini-1.5-flash", "mistral"]:
-            model_name = "gemini-2.5-flash"
-        
-        logger.info(f"Using model: {model_name}")
-        
-        # We need to instantiate the specific model requested
-        # The global one in model_manager might be different
-        import google.generativeai as genai
-        # Reuse configuration from manager if possible, but safe to re-configure or just use implicit
-        model = genai.GenerativeModel(model_name)
+        provider, model_name = await chat_providers.providers.resolve(request.model)
+        logger.info(f"Using model: {provider.name}/{model_name}")
         
         logger.info(f"Generating response for prompt: {request.message}")
-        
-        # Standard google-generativeai call
-        response = model.generate_content(request.message)
-        ai_text = response.text
+        if hedging.CHAT_HEDGING:
+            # May send a backup request to another model if this one is slow. A request
+            # that left `model` at the schema default didn't pick one, so the router does
+            unspecified = "model" not in request.model_fields_set or chat_providers.is_unspecified(request.model)
+            ai_text = await hedging.router.generate(provider.name, model_name, request.message,
+                                                    choose_primary=unspecified)
+        else:
+            ai_text = await provider.generate(model_name, request.message)
         
         logger.info(f"Response generated successfully")
             
@@ -64,32 +57,56 @@ async def chat(request: schemas.ChatRequest,
     # Save AI response
     ai_msg = models.ChatHistory(user_id=current_user.id, message=ai_text, role="assistant")
     db.add(ai_msg)
-    db.commit()
+    with tracing.span("db.save_message", role="assistant"):
+        await db.commit()
     
     return {"id": ai_msg.id, "user_id": ai_msg.user_id, "message": ai_msg.message, "role": ai_msg.role, "timestamp": ai_msg.timestamp}
 
 @router.get("/history", response_model=list[schemas.ChatResponse])
-def get_chat_history(current_user: models.User = Depends(auth.get_current_user),
-                     db: Session = Depends(database.get_db)):
-    return db.query(models.ChatHistory).filter(models.ChatHistory.user_id == current_user.id).all()
+def get_chat_history(limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=1000),
+                     before_id: Optional[int] = None,
+                     current_user: models.User = Depends(auth.get_current_user),
+                     db: Session = Depends(database.get_read_db)):
+    """The newest `limit` messages (with id < before_id), in ascending order
+
+    Pass the smallest id of a page as before_id to fetch the page before it;
+    older pages are read from the compressed archive only when reached.
+    """
+    # Rows come straight from our own tables in the ChatResponse shape, so skip
+    # response_model re-validation and serialize them directly
+    return OrjsonResponse(retention.read_history(db, current_user.id, limit=limit, before_id=before_id))
+
+@router.get("/search", response_model=schemas.ChatSearchResponse)
+def search_chat_history(q: str = Query(..., min_length=1, max_length=200),
+                        page: int = Query(1, ge=1),
+                        page_size: int = Query(20, ge=1, le=100),
+                        current_user: models.User = Depends(auth.get_current_user),
+                        db: Session = Depends(database.get_read_db)):
+    """Ranked full-text search over the user's messages (archived ones too where supported)"""
+    try:
+        # One extra row tells us whether another page exists
+        hits = search.search_messages(db, current_user.id, q, limit=page_size + 1, offset=(page - 1) * page_size)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    results = retention.fill_archived_hits(db, current_user.id, hits[:page_size])
+    return {"query": q, "page": page, "page_size": page_size, "has_more": len(hits) > page_size,
+            "includes_archived": search.searches_archive(db), "results": results}
 
 @router.get("/models")
 async def get_models():
-    """Return available chat models"""
+    """Return available chat models (Gemini, plus whatever the Ollama server has)"""
+    available = await chat_providers.providers.list_models()
+    local_models = available["ollama"]
     if GEMINI_API_KEY:
-        # Based on available models for this key
         return {
-            "models": [
-                "gemini-2.5-flash", 
-                "gemini-2.5-pro", 
-                "gemini-2.0-flash", 
-                "gemini-flash-latest"
-            ], 
-            "source": "Google Gemini"
+            "models": available["gemini"] + local_models,
+            "providers": available,
+            "source": "Google Gemini" + (" + Ollama" if local_models else "")
         }
     else:
         return {
-            "models": [FALLBACK_MODEL],
+            "models": local_models or [FALLBACK_MODEL],
+            "providers": available,
             "error": "GEMINI_API_KEY not configured",
             "note": "Get your API key from: https://makersuite.google.com/app/apikey"
         }
@@ -0,0 +1,161 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from .. import models, database, auth, retention
+from ..storage import storage
+import json
+import os
+import time
+import zipfile
+
+router = APIRouter(tags=["Export"])
+
+# Rows fetched per round-trip from the server-side cursor
+EXPORT_BATCH_SIZE = 500
+MEDIA_CHUNK_SIZE = 1024 * 1024
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _line(record):
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _stream(db, statement):
+    """Iterate ORM rows through a server-side cursor, EXPORT_BATCH_SIZE at a time"""
+    return db.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE)).scalars()
+
+
+def iter_export_records(db, user_id, media_paths=None):
+    """Yield one dict per exported row; referenced media paths are added to media_paths"""
+    for archive in _stream(db, select(models.ChatArchive)
+                           .where(models.ChatArchive.user_id == user_id)
+                           .order_by(models.ChatArchive.first_id)):
+        # Archived messages are older than anything still in the hot table
+        for m in json.loads(retention.decompress(archive.codec, archive.payload)):
+            yield {"type": "chat", "id": m["id"], "role": m["role"], "message": m["message"],
+                   "timestamp": m["timestamp"], "archived": True}
+
+    for chat in _stream(db, select(models.ChatHistory)
+                        .where(models.ChatHistory.user_id == user_id)
+                        .order_by(models.ChatHistory.id)):
+        yield {"type": "chat", "id": chat.id, "role": chat.role, "message": chat.message,
+               "timestamp": _iso(chat.timestamp), "archived": False}
+
+    for image in _stream(db, select(models.ImagePrompt)
+                         .where(models.ImagePrompt.user_id == user_id)
+                         .order_by(models.ImagePrompt.id)):
+        if media_paths is not None:
+            media_paths.append(image.image_path)
+        yield {"type": "image", "id": image.id, "prompt": image.prompt,
+               "image_path": image.image_path, "created_at": _iso(image.created_at)}
+
+    for video in _stream(db, select(models.VideoTask)
+                         .where(models.VideoTask.user_id == user_id)
+                         .order_by(models.VideoTask.id)):
+        if media_paths is not None:
+            media_paths.extend([video.source_video, video.output_video])
+        yield {"type": "video", "id": video.id, "prompt": video.prompt, "status": video.status,
+               "source_video": video.source_video, "output_video": video.output_video,
+               "duration": video.duration, "created_at": _iso(video.created_at)}
+
+
+def ndjson_export(user_id):
+    """NDJSON body, generated row by row on its own read session"""
+    db = database.ReadSessionLocal()
+    try:
+        for record in iter_export_records(db, user_id):
+            yield _line(record)
+    finally:
+        db.close()
+
+
+class _ZipSink:
+    """Write-only, non-seekable file object that hands written bytes back to the caller
+
+    zipfile detects the missing seek() and writes data descriptors instead of
+    patching local headers, so the archive can be streamed as it is built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_export(user_id):
+    """Zip body (data.ndjson + media/...) streamed without staging anything on disk"""
+    sink = _ZipSink()
+    media_paths = []
+    db = database.ReadSessionLocal()
+    try:
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open("data.ndjson", mode="w", force_zip64=True) as entry:
+                for record in iter_export_records(db, user_id, media_paths):
+                    entry.write(_line(record))
+                    # The compressor buffers internally; forward whatever it has flushed
+                    data = sink.drain()
+                    if data:
+                        yield data
+            db.close()
+            yield sink.drain()
+
+            seen = set()
+            for path in media_paths:
+                if not path or path in seen:
+                    continue
+                seen.add(path)
+                try:
+                    # Local working copy, or streamed from the bucket when this node has none
+                    source = storage.open(path)
+                except FileNotFoundError:
+                    continue
+                relative = path[len("static/"):] if path.startswith("static/") else os.path.basename(path)
+                arcname = "media/" + relative.replace(os.sep, "/")
+                local = os.path.isfile(path)
+                if local:
+                    info = zipfile.ZipInfo.from_file(path, arcname)
+                else:
+                    info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+                # Images and videos are already compressed
+                info.compress_type = zipfile.ZIP_STORED
+                with source, archive.open(info, mode="w", force_zip64=not local) as entry:
+                    while chunk := source.read(MEDIA_CHUNK_SIZE):
+                        entry.write(chunk)
+                        yield sink.drain()
+        # Central directory
+        yield sink.drain()
+    finally:
+        db.close()
+
+
+@router.get("")
+def export_data(include_media: bool = False,
+                current_user: models.User = Depends(auth.get_current_user)):
+    """Stream all of the user's chats, images and videos as NDJSON, or as a zip with media files"""
+    if include_media:
+        return StreamingResponse(
+            zip_export(current_user.id), media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="nova-export-{current_user.id}.zip"'},
+        )
+    return StreamingResponse(
+        ndjson_export(current_user.id), media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="nova-export-{current_user.id}.ndjson"'},
+    )
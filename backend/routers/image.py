@@ -1,23 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from .. import schemas, models, database, auth, model_manager
+from .. import schemas, models, database, auth, model_manager, metrics, tracing, image_encoding, scheduler
+from ..storage import storage
 from pathlib import Path
 import logging
-import torch
+import os
+import sys
+import uuid
 
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["Image Generation"])
 
+def _is_gpu_out_of_memory(exc):
+    # torch is only loaded once a pipeline exists, so don't import it here
+    torch = sys.modules.get("torch")
+    return torch is not None and isinstance(exc, torch.cuda.OutOfMemoryError)
+
+def publish_variants(path, image_format, quality):
+    """Background step: write the thumbnails and publish them to media storage"""
+    image_encoding.make_variants(path, image_format, quality)
+    for _, variant in image_encoding.variant_paths(path):
+        if os.path.exists(variant):
+            try:
+                storage.put(variant)
+            except Exception as e:
+                logger.error(f"Could not publish thumbnail {variant}: {e}")
+
 @router.post("/generate", response_model=schemas.ImageResponse)
 def generate_image(request: schemas.ImageRequest,
+                   background_tasks: BackgroundTasks,
                    current_user: models.User = Depends(auth.get_current_user),
                    db: Session = Depends(database.get_db)):
-    
+
+    image_format = request.format or image_encoding.DEFAULT_FORMAT
+    try:
+        ext = image_encoding.get_format(image_format)["ext"]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.quality is not None and not 1 <= request.quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+
     output_dir = Path("static/generated_images")
     output_dir.mkdir(parents=True, exist_ok=True)
-    filename = f"{current_user.id}_{request.prompt[:10].replace(' ', '_')}.png"
+    # Unique per image, so the file never changes and can be served as immutable
+    filename = f"{current_user.id}_{request.prompt[:10].replace(' ', '_')}_{uuid.uuid4().hex[:8]}{ext}"
     filepath = output_dir / filename
 
+    # Waits for this user's fair share of the pipeline (429 when over quota)
+    job = scheduler.image_jobs.acquire(current_user)
     try:
         # Get the pipeline
         pipe = model_manager.get_stable_diffusion_pipeline()
@@ -36,17 +66,21 @@ def generate_image(request: schemas.ImageRequest,
         else:
             steps = 6  # GPU can use slightly more for better quality
             
-        image = pipe(request.prompt, num_inference_steps=steps).images[0]
-        image.save(filepath)
+        with metrics.diffusion_inference_duration.time(str(steps), pipe.device.type), \
+                tracing.span("diffusion.pipeline", steps=steps, device=pipe.device.type):
+            image = pipe(request.prompt, num_inference_steps=steps).images[0]
+        with tracing.span("image.encode", format=image_format):
+            image_encoding.save_image(image, str(filepath), image_format, request.quality)
+        image_width = image.width
         logger.info(f"Image saved to {filepath}")
         
-    except torch.cuda.OutOfMemoryError:
-        logger.error("GPU out of memory")
-        raise HTTPException(
-            status_code=503,
-            detail="GPU out of memory. Please try again or use CPU mode."
-        )
     except Exception as e:
+        if _is_gpu_out_of_memory(e):
+            logger.error("GPU out of memory")
+            raise HTTPException(
+                status_code=503,
+                detail="GPU out of memory. Please try again or use CPU mode."
+            )
         logger.error(f"Image generation error: {e}")
         # Fallback: Create a placeholder image
         try:
@@ -55,15 +89,32 @@ def generate_image(request: schemas.ImageRequest,
             d = ImageDraw.Draw(img)
             text = f"Generation Error\n{str(e)[:30]}\nPrompt: {request.prompt[:20]}"
             d.text((10, 10), text, fill=(255, 255, 0))
-            img.save(filepath)
+            image_encoding.save_image(img, str(filepath), image_format, request.quality)
+            image_width = img.width
             logger.info(f"Placeholder image created for error handling")
         except:
             raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
+    finally:
+        scheduler.image_jobs.release(job)
         
+    try:
+        storage.put(str(filepath))
+    except Exception as e:
+        logger.error(f"Could not publish image {filepath}: {e}")
+        raise HTTPException(status_code=503, detail="Media storage is unavailable")
+
     # Save to DB
     db_image = models.ImagePrompt(user_id=current_user.id, prompt=request.prompt, image_path=str(filepath))
     db.add(db_image)
     db.commit()
     db.refresh(db_image)
-    
-    return schemas.ImageResponse(id=db_image.id, prompt=db_image.prompt, image_url=f"/static/generated_images/{filename}", created_at=db_image.created_at)
+
+    # Thumbnails are derived after the response is sent
+    background_tasks.add_task(publish_variants, str(filepath), image_format, request.quality)
+    variants = [
+        schemas.ImageVariant(width=w, url=storage.url(path))
+        for w, path in image_encoding.variant_paths(str(filepath), image_width)
+    ]
+
+    return schemas.ImageResponse(id=db_image.id, prompt=db_image.prompt, image_url=storage.url(str(filepath)),
+                                 created_at=db_image.created_at, format=image_format, variants=variants)
@@ -1,16 +1,82 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .. import schemas, models, database, auth
+from .. import schemas, models, database, auth, video_processing, video_cache, scheduler
+from ..storage import storage
+import asyncio
 import subprocess
 import uuid
 import os
+import shutil
+import logging
 
+logger = logging.getLogger(__name__)
 router = APIRouter(tags=["Video Processing"])
 
+PROXY_DIR = "static/proxies"
+THUMBNAIL_DIR = "static/thumbnails"
+
+
+def _url(path):
+    return storage.url(path) if path else None
+
+
+def video_response(task, output_url=None, hls_url=None):
+    """Build the API response for a video task"""
+    return schemas.VideoResponse(
+        id=task.id, user_id=task.user_id, prompt=task.prompt, status=task.status,
+        output_url=output_url, hls_url=hls_url, created_at=task.created_at,
+        duration=task.duration, width=task.width, height=task.height,
+        video_codec=task.video_codec, audio_codec=task.audio_codec,
+        keyframe_interval=task.keyframe_interval,
+        proxy_url=_url(task.proxy_video), thumbnail_sprite_url=_url(task.thumbnail_sprite),
+        thumbnail_interval=task.thumbnail_interval,
+    )
+
+
+def prepare_upload(task_id):
+    """Background step after upload: probe metadata, build the proxy and sprite sheet"""
+    db = database.SessionLocal()
+    job = None
+    try:
+        task = db.query(models.VideoTask).filter(models.VideoTask.id == task_id).first()
+        if task is None:
+            return
+        source = task.source_video
+        base = os.path.splitext(os.path.basename(source))[0]
+        storage.put(source)
+        # The upload was already accepted: queue fairly and charge the time, but never refuse it
+        job = scheduler.video_jobs.acquire(task.user, check_quota=False)
+
+        meta = video_processing.probe_media(source)
+        for field, value in meta.items():
+            setattr(task, field, value)
+        db.commit()
+
+        os.makedirs(PROXY_DIR, exist_ok=True)
+        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+        proxy_path = os.path.join(PROXY_DIR, f"{base}_proxy.mp4")
+        sprite_path = os.path.join(THUMBNAIL_DIR, f"{base}_sprite.jpg")
+        video_processing.make_proxy(source, proxy_path)
+        task.proxy_video = storage.put(proxy_path)
+        task.thumbnail_interval = video_processing.make_sprite(source, sprite_path, meta["duration"])
+        task.thumbnail_sprite = storage.put(sprite_path)
+        db.commit()
+        logger.info(f"Prepared previews for video task {task_id}")
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logger.warning(f"Could not prepare previews for video task {task_id}: {e}")
+    except Exception as e:
+        logger.error(f"Could not prepare video task {task_id}: {e}")
+    finally:
+        if job is not None:
+            scheduler.video_jobs.release(job)
+        db.close()
+
 @router.post("/upload", response_model=schemas.VideoResponse)
-async def upload_video(file: UploadFile = File(...),
+async def upload_video(background_tasks: BackgroundTasks,
+                       file: UploadFile = File(...),
                        current_user: models.User = Depends(auth.get_current_user),
-                       db: Session = Depends(database.get_db)):
+                       db: AsyncSession = Depends(database.get_async_db)):
     
     # Save the file
     upload_dir = "static/uploads"
@@ -19,16 +85,25 @@ async def upload_video(file: UploadFile = File(...),
     filename = f"{file_id}_{file.filename}"
     filepath = os.path.join(upload_dir, filename)
     
-    with open(filepath, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
+    # Stream to disk in chunks, hashing on the way for the processing cache;
+    # file I/O and hashing run in threads so the event loop keeps serving
+    buffer = await asyncio.to_thread(video_cache.HashingWriter, filepath)
+    try:
+        while chunk := await file.read(video_cache.HASH_CHUNK_SIZE):
+            await asyncio.to_thread(buffer.write, chunk)
+    finally:
+        await asyncio.to_thread(buffer.close)
         
-    task = models.VideoTask(user_id=current_user.id, prompt="Uploaded", source_video=filepath, status="pending")
+    task = models.VideoTask(user_id=current_user.id, prompt="Uploaded", source_video=filepath,
+                            source_hash=buffer.hexdigest(), status="pending")
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    await db.commit()
+    await db.refresh(task)
+    
+    # Probe + proxy + sprite run after the response so uploads return immediately
+    background_tasks.add_task(prepare_upload, task.id)
     
-    return schemas.VideoResponse(id=task.id, user_id=task.user_id, prompt=task.prompt, status=task.status, output_url=None, created_at=task.created_at)
+    return video_response(task)
 
 @router.post("/process/{task_id}", response_model=schemas.VideoResponse)
 def process_video(task_id: int, request: schemas.VideoRequest,
@@ -42,41 +117,147 @@ def process_video(task_id: int, request: schemas.VideoRequest,
     if task.user_id != current_user.id:
          raise HTTPException(status_code=403, detail="Not authorized")
 
-    # Simple text-to-ffmpeg logic mapping
-    prompt_lower = request.prompt.lower()
-    filter_arg = ""
-    
-    if "black and white" in prompt_lower or "grayscale" in prompt_lower:
-        filter_arg = "hue=s=0"
-    elif "sepia" in prompt_lower:
-        filter_arg = "colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131"
-    elif "mirror" in prompt_lower:
-        filter_arg = "hflip"
-    elif "reverse" in prompt_lower:
-        filter_arg = "reverse"
-    else:
-        # Default fallback or error
-        filter_arg = "eq=brightness=0.06:saturation=2" # cinematic "pop" default
+    try:
+        video_filter = video_processing.prompt_to_filter(request.prompt)
+        video_processing.get_profile(request.profile)
+        filtergraph = video_cache.normalize_filtergraph(video_filter, request.start, request.end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    output_filename = f"processed_{os.path.basename(task.source_video)}"
-    output_path = os.path.join("static/processed", output_filename)
-    os.makedirs("static/processed", exist_ok=True)
+    try:
+        # Uploads handled by another node are fetched from media storage
+        storage.ensure_local(task.source_video)
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="Source video is not available yet, try again shortly")
+    if not task.source_hash:
+        # Uploaded before the cache existed
+        task.source_hash = video_cache.hash_file(task.source_video)
+    if request.preview:
+        return preview_video(task, request, video_filter, filtergraph, current_user)
+    key = video_cache.cache_key(task.source_hash, filtergraph, request.profile)
+    previous_output = task.output_video
     
+    job = None
     try:
-        command = [
-            "ffmpeg", "-y", "-i", task.source_video, "-vf", filter_arg, output_path
-        ]
-        subprocess.run(command, check=True)
-        
-        task.output_video = output_path
-        task.status = "completed"
-        task.prompt = request.prompt
-        db.commit()
+        # Normally one pass; a second one only if a concurrent delete released
+        # the cached output between our lookup and our claim on it
+        for _ in range(2):
+            output_path = video_cache.lookup(key, task.source_video)
+            if job is None and (output_path is None or (request.hls and video_cache.hls_master_for(output_path) is None)):
+                # Cache hits cost nothing; real work waits for the user's fair share (429 when over quota)
+                job = scheduler.video_jobs.acquire(current_user)
+            if output_path is None:
+                output_path = video_cache.output_path_for(key, task.source_video)
+                os.makedirs(video_cache.PROCESSED_DIR, exist_ok=True)
+                temp_path = video_cache.temp_path_for(output_path)
+                try:
+                    video_processing.process(
+                        task.source_video, temp_path, request.prompt,
+                        profile=request.profile, start=request.start, end=request.end,
+                        segments=request.segments,
+                    )
+                    video_cache.commit_output(temp_path, output_path)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                storage.put(output_path)
+            else:
+                logger.info(f"Processing cache hit for task {task.id}: {output_path}")
+            
+            hls_master = video_cache.hls_master_for(output_path)
+            if request.hls and hls_master is None:
+                hls_dir = video_cache.hls_dir_for(output_path)
+                temp_dir = video_cache.temp_path_for(hls_dir)
+                try:
+                    video_processing.package_hls(storage.ensure_local(output_path), temp_dir, profile=request.profile)
+                    video_cache.commit_output(temp_dir, hls_dir)
+                finally:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                storage.put_dir(hls_dir)
+                hls_master = video_cache.hls_master_for(output_path)
+            
+            task.status = "completed"
+            task.prompt = request.prompt
+            if video_cache.claim(db, task, output_path):
+                break
+            logger.warning(f"Cached output {output_path} was released while task {task.id} was using it; redoing")
+        else:
+            raise HTTPException(status_code=503, detail="Processed video was removed concurrently, please retry")
         db.refresh(task)
+        if previous_output != output_path:
+            video_cache.release(db, previous_output)
         
-        return schemas.VideoResponse(id=task.id, user_id=task.user_id, prompt=task.prompt, status=task.status, output_url=f"/static/processed/{output_filename}", created_at=task.created_at)
+        return video_response(task, output_url=_url(output_path), hls_url=_url(hls_master))
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except subprocess.CalledProcessError as e:
         task.status = "failed"
         db.commit()
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    finally:
+        if job is not None:
+            scheduler.video_jobs.release(job)
+
+def preview_video(task, request, video_filter, filtergraph, user):
+    """Dry-run an effect on the upload's low-res proxy; the task itself is left untouched"""
+    try:
+        proxy_video = storage.ensure_local(task.proxy_video) if task.proxy_video else None
+    except FileNotFoundError:
+        proxy_video = None
+    if proxy_video is None:
+        raise HTTPException(status_code=409, detail="Preview proxy is not ready yet, try again shortly")
+    
+    key = video_cache.cache_key(f"{task.source_hash}/proxy", filtergraph, "fast")
+    preview_path = video_cache.preview_path_for(task.source_hash, key)
+    if storage.exists(preview_path):
+        video_cache.touch_preview(preview_path)
+    else:
+        os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+        temp_path = video_cache.temp_path_for(preview_path)
+        job = scheduler.video_jobs.acquire(user)
+        try:
+            video_processing.process(proxy_video, temp_path, request.prompt,
+                                     profile="fast", start=request.start, end=request.end)
+            video_cache.commit_output(temp_path, preview_path)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(status_code=500, detail=f"Preview failed: {str(e)}")
+        finally:
+            scheduler.video_jobs.release(job)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        storage.put(preview_path)
+    
+    response = video_response(task, output_url=_url(preview_path))
+    response.status = "preview"
+    return response
+
+@router.delete("/{task_id}")
+def delete_video(task_id: int,
+                 current_user: models.User = Depends(auth.get_current_user),
+                 db: Session = Depends(database.get_db)):
+    
+    task = db.query(models.VideoTask).filter(models.VideoTask.id == task_id).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="Video task not found")
+    
+    if task.user_id != current_user.id:
+         raise HTTPException(status_code=403, detail="Not authorized")
+    
+    output_video = task.output_video
+    source_hash = task.source_hash
+    owned_files = [task.source_video, task.proxy_video, task.thumbnail_sprite]
+    db.delete(task)
+    db.commit()
+    
+    # Uploads and their proxies belong to a single task; processed outputs and
+    # effect previews may be shared with other tasks through the cache
+    for path in owned_files:
+        if path:
+            storage.delete(path)
+    video_cache.release(db, output_video)
+    video_cache.release_previews(db, source_hash)
+    
+    return {"message": "Video task deleted"}
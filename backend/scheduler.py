@@ -0,0 +1,258 @@
+"""
+Fair scheduling and compute quotas for expensive jobs
+Image generation and video transcodes run through a JobQueue instead of
+starting as soon as a request thread picks them up:
+  - a queue has a fixed number of slots (the GPU pipeline, ffmpeg workers)
+  - when a slot frees up, the waiting job with the smallest virtual finish
+    time goes next (weighted fair queueing): each job advances its user's
+    virtual clock by estimated cost / weight, so a user with 100 queued
+    jobs doesn't delay a user submitting their first
+  - a user runs at most N jobs at once and may only have a few waiting,
+    so one user can't tie up the whole request threadpool either
+  - wall time spent in a slot is charged to a rolling per-user quota of
+    compute seconds; users over quota get 429 with the time it resets
+
+Weights and quotas can be set per username, e.g.
+    SCHEDULER_USER_WEIGHTS=alice=2,batchbot=0.5
+    COMPUTE_QUOTA_OVERRIDES=alice=7200,batchbot=0   (0 = unlimited)
+Accounting is in memory, per process.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from fastapi import HTTPException, status
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _user_map(value):
+    """'alice=2,bob=0.5' -> {'alice': 2.0, 'bob': 0.5}"""
+    result = {}
+    for item in value.split(","):
+        name, _, number = item.partition("=")
+        if name.strip() and number.strip():
+            result[name.strip()] = float(number)
+    return result
+
+
+IMAGE_JOB_SLOTS = int(os.getenv("IMAGE_JOB_SLOTS", "1"))
+VIDEO_JOB_SLOTS = int(os.getenv("VIDEO_JOB_SLOTS", "2"))
+# Per user, per queue
+MAX_RUNNING_PER_USER = int(os.getenv("SCHEDULER_MAX_RUNNING_PER_USER", "1"))
+MAX_QUEUED_PER_USER = int(os.getenv("SCHEDULER_MAX_QUEUED_PER_USER", "3"))
+MAX_WAIT_SECONDS = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", "120"))
+USER_WEIGHTS = _user_map(os.getenv("SCHEDULER_USER_WEIGHTS", ""))
+
+COMPUTE_QUOTA_SECONDS = float(os.getenv("COMPUTE_QUOTA_SECONDS", "1800"))
+COMPUTE_QUOTA_WINDOW_SECONDS = float(os.getenv("COMPUTE_QUOTA_WINDOW_SECONDS", "86400"))
+COMPUTE_QUOTA_OVERRIDES = _user_map(os.getenv("COMPUTE_QUOTA_OVERRIDES", ""))
+
+
+def _duration(seconds):
+    """1800 -> '30m', 86400 -> '24h'"""
+    for unit, size in (("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{seconds / size:g}{unit}"
+    return f"{seconds:g}s"
+
+
+def user_weight(user):
+    return max(USER_WEIGHTS.get(user.username, 1.0), 0.01)
+
+
+class ComputeQuota:
+    """Rolling window of compute seconds used per user"""
+
+    def __init__(self, quota_seconds, window_seconds, overrides=None, max_users=10000):
+        self.quota = quota_seconds
+        self.window = window_seconds
+        self.overrides = overrides or {}
+        self.max_users = max_users
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def limit_for(self, user):
+        return self.overrides.get(user.username, self.quota)
+
+    def _recent(self, user_id, now):
+        events = self._usage.get(user_id)
+        if events is None:
+            return deque()
+        while events and events[0][0] <= now - self.window:
+            events.popleft()
+        return events
+
+    def used(self, user):
+        with self._lock:
+            return sum(seconds for _, seconds in self._recent(user.id, time.time()))
+
+    def reset_at(self, user):
+        """Epoch time at which the user is back under quota, or None if they already are"""
+        limit = self.limit_for(user)
+        now = time.time()
+        with self._lock:
+            events = list(self._recent(user.id, now))
+        used = sum(seconds for _, seconds in events)
+        if limit <= 0 or used < limit:
+            return None
+        for started, seconds in events:
+            used -= seconds
+            if used < limit:
+                return started + self.window
+        return now
+
+    def check(self, user):
+        """Raise 429 (with the reset time) if the user has used up their quota"""
+        reset = self.reset_at(user)
+        if reset is None:
+            return
+        retry_after = max(1, int(reset - time.time()) + 1)
+        reset_iso = datetime.fromtimestamp(reset, timezone.utc).isoformat(timespec="seconds")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=(f"Compute quota exceeded: {_duration(self.limit_for(user))} of generation/transcode time "
+                    f"per {_duration(self.window)}. Quota resets at {reset_iso}"),
+            headers={"Retry-After": str(retry_after), "X-Quota-Reset": reset_iso},
+        )
+
+    def charge(self, user, seconds):
+        now = time.time()
+        with self._lock:
+            events = self._usage.get(user.id)
+            if events is None:
+                events = self._usage[user.id] = deque()
+                while len(self._usage) > self.max_users:
+                    self._usage.pop(next(iter(self._usage)))
+            events.append((now, seconds))
+
+
+compute_quota = ComputeQuota(COMPUTE_QUOTA_SECONDS, COMPUTE_QUOTA_WINDOW_SECONDS, COMPUTE_QUOTA_OVERRIDES)
+
+
+class Ticket:
+    __slots__ = ("user", "weight", "start_tag", "finish_tag", "seq", "started_at")
+
+    def __init__(self, user, weight, start_tag, finish_tag, seq):
+        self.user = user
+        self.weight = weight
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.started_at = None
+
+    def __lt__(self, other):
+        return (self.finish_tag, self.seq) < (other.finish_tag, other.seq)
+
+
+class JobQueue:
+    """Weighted fair queue in front of a fixed number of job slots"""
+
+    def __init__(self, name, slots, quota=compute_quota, max_running_per_user=MAX_RUNNING_PER_USER,
+                 max_queued_per_user=MAX_QUEUED_PER_USER, max_wait=MAX_WAIT_SECONDS):
+        self.name = name
+        self.slots = max(1, slots)
+        self.quota = quota
+        self.max_running_per_user = max(1, max_running_per_user)
+        self.max_queued_per_user = max_queued_per_user
+        self.max_wait = max_wait
+        self.running = 0
+        self._running_by_user = Counter()
+        self._queued_by_user = Counter()
+        self._waiting = []
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        # Typical job duration, to size each job's share of virtual time
+        self._cost_estimate = 1.0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def queued(self):
+        with self._cond:
+            return len(self._waiting)
+
+    def _next_eligible(self):
+        for ticket in sorted(self._waiting):
+            if self._running_by_user[ticket.user.id] < self.max_running_per_user:
+                return ticket
+        return None
+
+    def acquire(self, user, check_quota=True):
+        """Block until a slot is granted to this user's job; returns the ticket to release
+
+        check_quota=False is for work that was already accepted (e.g. background
+        processing of an upload): it skips the quota, the queued-jobs limit and
+        the wait deadline, so it is queued fairly but never refused.
+        """
+        if check_quota and self.quota is not None:
+            self.quota.check(user)
+        weight = user_weight(user)
+        deadline = time.monotonic() + self.max_wait if check_quota else None
+        with self._cond:
+            if check_quota and self._queued_by_user[user.id] >= self.max_queued_per_user:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail=f"Too many {self.name} jobs queued, wait for one to finish",
+                    headers={"Retry-After": str(max(1, round(self._cost_estimate)))},
+                )
+            start_tag = max(self._virtual_time, self._last_finish.get(user.id, 0.0))
+            ticket = Ticket(user, weight, start_tag, start_tag + self._cost_estimate / weight, next(self._seq))
+            self._last_finish[user.id] = ticket.finish_tag
+            self._waiting.append(ticket)
+            self._queued_by_user[user.id] += 1
+            try:
+                while not (self.running < self.slots and self._next_eligible() is ticket):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise HTTPException(
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"The {self.name} queue is busy, please try again shortly",
+                            headers={"Retry-After": str(max(1, round(self._cost_estimate)))},
+                        )
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._remove(ticket)
+            self.running += 1
+            self._running_by_user[user.id] += 1
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+        ticket.started_at = time.monotonic()
+        return ticket
+
+    def _remove(self, ticket):
+        self._waiting.remove(ticket)
+        self._queued_by_user[ticket.user.id] -= 1
+        if self._queued_by_user[ticket.user.id] <= 0:
+            del self._queued_by_user[ticket.user.id]
+
+    def release(self, ticket):
+        elapsed = time.monotonic() - ticket.started_at
+        with self._cond:
+            self.running -= 1
+            self._running_by_user[ticket.user.id] -= 1
+            if self._running_by_user[ticket.user.id] <= 0:
+                del self._running_by_user[ticket.user.id]
+            self._cost_estimate = 0.8 * self._cost_estimate + 0.2 * max(elapsed, 0.01)
+            self._cond.notify_all()
+        if self.quota is not None:
+            self.quota.charge(ticket.user, elapsed)
+        logger.debug(f"{self.name} job for user {ticket.user.id} took {elapsed:.2f}s")
+        return elapsed
+
+
+image_jobs = JobQueue("image", IMAGE_JOB_SLOTS)
+video_jobs = JobQueue("video", VIDEO_JOB_SLOTS)
+
+metrics.Gauge("scheduler_jobs_running", "Expensive jobs holding a slot",
+              lambda: {(q.name,): q.running for q in (image_jobs, video_jobs)}, ["queue"])
+metrics.Gauge("scheduler_jobs_queued", "Expensive jobs waiting for a slot",
+              lambda: {(q.name,): q.queued() for q in (image_jobs, video_jobs)}, ["queue"])
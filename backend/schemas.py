@@ -29,6 +29,7 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
     email: Optional[str] = None
+    user_id: Optional[int] = None
 
 # CHAT
 class ChatMessage(BaseModel):
@@ -49,17 +50,42 @@ class ChatResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ChatSearchHit(BaseModel):
+    id: int
+    role: str
+    timestamp: datetime
+    snippet: str
+    rank: float
+    archived: bool = False
+
+class ChatSearchResponse(BaseModel):
+    query: str
+    page: int
+    page_size: int
+    has_more: bool
+    # False where archived messages can't be searched (PostgreSQL)
+    includes_archived: bool
+    results: List[ChatSearchHit]
+
 # IMAGE
 class ImageRequest(BaseModel):
     prompt: str
     width: int = 512
     height: int = 512
-    
+    format: Optional[str] = None  # webp, avif, jpeg or png (server default when omitted)
+    quality: Optional[int] = None  # 1-100, per-format default when omitted
+
+class ImageVariant(BaseModel):
+    width: int
+    url: str
+
 class ImageResponse(BaseModel):
     id: int
     prompt: str
     image_url: str
     created_at: datetime
+    format: Optional[str] = None
+    variants: List[ImageVariant] = []  # thumbnails, smallest first; written just after the response
     
     class Config:
         from_attributes = True
@@ -67,6 +93,12 @@ class ImageResponse(BaseModel):
 # VIDEO
 class VideoRequest(BaseModel):
     prompt: str
+    profile: str = "balanced"  # fast, balanced or archive
+    start: Optional[float] = None  # trim start in seconds
+    end: Optional[float] = None  # trim end in seconds
+    segments: Optional[int] = None  # >1 processes keyframe-split segments in parallel
+    hls: bool = False  # also package the output as adaptive HLS
+    preview: bool = False  # dry-run the effect on the low-res proxy instead of the source
     
 class VideoResponse(BaseModel):
     id: int
@@ -74,7 +106,17 @@ class VideoResponse(BaseModel):
     prompt: str
     status: str
     output_url: Optional[str]
+    hls_url: Optional[str] = None
     created_at: datetime
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    keyframe_interval: Optional[float] = None
+    proxy_url: Optional[str] = None
+    thumbnail_sprite_url: Optional[str] = None
+    thumbnail_interval: Optional[float] = None
     
     class Config:
         from_attributes = True
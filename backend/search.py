@@ -0,0 +1,198 @@
+"""
+Full-text search over chat history
+SQLite: an FTS5 table kept in sync by triggers on chat_history, with the
+user id as an indexed column so each query only touches one user's rows.
+PostgreSQL: a GIN index on to_tsvector(message), maintained by the database.
+
+On SQLite, messages moved to the archive by the retention job stay in the
+index (their role and timestamp are then read back from the segment). The
+PostgreSQL index covers chat_history only, so archived messages drop out of it.
+
+Backfill rows that existed before the index was created with:
+    python -m backend.search --backfill
+"""
+
+import argparse
+import logging
+import re
+
+from sqlalchemy import text
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "chat_history_fts"
+BACKFILL_BATCH_SIZE = 5000
+SNIPPET_TOKENS = 12
+
+_SQLITE_SETUP = [
+    # Own copy of the text (not external content) so deleting a row that was
+    # never indexed is a harmless no-op. user_id is indexed too, so a query
+    # filtered on it only ranks that user's matches
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(message, user_id, tokenize='porter unicode61')",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_history_fts_insert AFTER INSERT ON chat_history BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, message, user_id) VALUES (new.id, new.message, new.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_history_fts_delete AFTER DELETE ON chat_history BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_history_fts_update AFTER UPDATE OF message ON chat_history BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, message, user_id) VALUES (new.id, new.message, new.user_id);
+    END""",
+    # Backfill bookkeeping: rows up to 'target' predate the triggers, 'done' is progress
+    "CREATE TABLE IF NOT EXISTS chat_search_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+]
+
+_POSTGRES_SETUP = [
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_message_fts ON chat_history USING GIN (to_tsvector('english', message))",
+]
+
+
+def _dialect(bind):
+    return bind.dialect.name
+
+
+def setup_search_index(bind=None):
+    """Create the search index for the configured database (idempotent)"""
+    bind = bind or database.engine
+    dialect = _dialect(bind)
+    with bind.begin() as conn:
+        if dialect == "sqlite":
+            existing = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type='table' AND name=:name"), {"name": FTS_TABLE}
+            ).scalar()
+            if existing is not None and "UNINDEXED" in existing.upper():
+                # Older layout that filtered users after ranking everyone's matches; rebuild it
+                logger.warning("Rebuilding the chat search index with an indexed user_id column")
+                conn.execute(text(f"DROP TABLE {FTS_TABLE}"))
+                existing = None
+            fresh = existing is None
+            for statement in _SQLITE_SETUP:
+                conn.execute(text(statement))
+            if fresh:
+                # Everything already in chat_history has to come from the backfill
+                target = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM chat_history")).scalar()
+                conn.execute(text("INSERT OR REPLACE INTO chat_search_state VALUES ('target', :t), ('done', 0)"), {"t": target})
+                if target:
+                    logger.warning(f"Chat search index created; run 'python -m backend.search --backfill' to index {target} existing rows")
+        elif dialect == "postgresql":
+            for statement in _POSTGRES_SETUP:
+                conn.execute(text(statement))
+        else:
+            logger.warning(f"Chat search is not supported on {dialect}")
+
+
+def backfill(bind=None, batch_size=BACKFILL_BATCH_SIZE):
+    """Index rows that existed before the triggers, in batches (resumable)"""
+    bind = bind or database.engine
+    if _dialect(bind) != "sqlite":
+        return 0
+    indexed = 0
+    while True:
+        with bind.begin() as conn:
+            state = dict(conn.execute(text("SELECT name, value FROM chat_search_state")).all())
+            done, target = state.get("done", 0), state.get("target", 0)
+            if done >= target:
+                break
+            upper = conn.execute(text(
+                "SELECT MAX(id) FROM (SELECT id FROM chat_history WHERE id > :done AND id <= :target ORDER BY id LIMIT :n)"
+            ), {"done": done, "target": target, "n": batch_size}).scalar() or target
+            result = conn.execute(text(
+                f"INSERT INTO {FTS_TABLE}(rowid, message, user_id) "
+                "SELECT id, message, user_id FROM chat_history WHERE id > :done AND id <= :upper "
+                f"AND id NOT IN (SELECT rowid FROM {FTS_TABLE} WHERE rowid > :done AND rowid <= :upper)"
+            ), {"done": done, "upper": upper})
+            conn.execute(text("UPDATE chat_search_state SET value = :upper WHERE name = 'done'"), {"upper": upper})
+            indexed += result.rowcount or 0
+        logger.info(f"Chat search backfill: indexed through id {upper} of {target}")
+    return indexed
+
+
+def _has_index(db):
+    return db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"), {"name": FTS_TABLE}
+    ).first() is not None
+
+
+def searches_archive(db):
+    """Whether archived messages are still returned by search_messages"""
+    return _dialect(db.get_bind()) == "sqlite"
+
+
+def keep_archived_indexed(db, rows):
+    """Put archived rows back into the index after they leave chat_history
+
+    Called by the retention job in the same transaction as the delete, which
+    fired the trigger that removed them.
+    """
+    if not rows or not searches_archive(db) or not _has_index(db):
+        return
+    db.execute(
+        text(f"INSERT INTO {FTS_TABLE}(rowid, message, user_id) VALUES (:id, :message, :user_id)"),
+        [{"id": r.id, "message": r.message, "user_id": r.user_id} for r in rows],
+    )
+
+
+def _fts5_query(query):
+    """Quote each term so user input can't inject FTS5 syntax; terms are ANDed"""
+    terms = re.findall(r"\w+", query, flags=re.UNICODE)
+    return " ".join(f'"{t}"' for t in terms)
+
+
+def search_messages(db, user_id, query, limit=20, offset=0):
+    """Ranked search over one user's messages; returns dicts with a highlighted snippet
+
+    Hits for archived messages have archived=True and no role or timestamp;
+    retention.fill_archived_hits reads those from the archive segments.
+    """
+    dialect = _dialect(db.get_bind())
+    params = {"uid": user_id, "limit": limit, "offset": offset}
+    if dialect == "sqlite":
+        match = _fts5_query(query)
+        if not match:
+            return []
+        # The user filter is part of the MATCH, so FTS5 intersects it with the
+        # terms before ranking; bm25 weighs only the message column
+        params["q"] = f'message : ({match}) AND user_id : "{int(user_id)}"'
+        sql = text(f"""
+            SELECT {FTS_TABLE}.rowid AS id, c.role, c.timestamp, c.id IS NULL AS archived,
+                   snippet({FTS_TABLE}, 0, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}) AS snippet,
+                   bm25({FTS_TABLE}, 1.0, 0.0) AS rank
+            FROM {FTS_TABLE} LEFT JOIN chat_history c ON c.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH :q
+            ORDER BY rank
+            LIMIT :limit OFFSET :offset
+        """)
+    elif dialect == "postgresql":
+        params["q"] = query
+        sql = text("""
+            SELECT c.id, c.role, c.timestamp, false AS archived,
+                   ts_headline('english', c.message, q, 'StartSel=<mark>,StopSel=</mark>,MaxWords=25,MinWords=8') AS snippet,
+                   -ts_rank(to_tsvector('english', c.message), q) AS rank
+            FROM chat_history c, websearch_to_tsquery('english', :q) q
+            WHERE c.user_id = :uid AND to_tsvector('english', c.message) @@ q
+            ORDER BY rank
+            LIMIT :limit OFFSET :offset
+        """)
+    else:
+        raise NotImplementedError(f"Chat search is not supported on {dialect}")
+    rows = db.execute(sql, params).mappings().all()
+    return [dict(r, archived=bool(r["archived"])) for r in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat search index maintenance")
+    parser.add_argument("--backfill", action="store_true", help="index rows that predate the search index")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    database.Base.metadata.create_all(bind=database.engine)
+    setup_search_index()
+    if args.backfill:
+        print(f"Indexed {backfill(batch_size=args.batch_size)} messages")
+
+
+if __name__ == "__main__":
+    main()
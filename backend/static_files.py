@@ -0,0 +1,169 @@
+"""
+Static file serving with cache headers for media
+Byte-range requests are answered by Starlette's FileResponse.
+
+CSS/JS are linked through versioned URLs (static_url in templates adds
+?v=<content hash>), so they can be cached as immutable and the URL changes
+whenever the file does. Precompressed .br/.gz siblings are served to clients
+that accept them; build them with:
+    python -m backend.static_files --compress
+"""
+
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from fastapi.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # optional, .gz variants are always built
+    brotli = None
+
+# Not in every platform's mime table; players refuse playlists served as text/plain
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+STATIC_URL_PREFIX = "/static/"
+VERSION_LENGTH = 12
+
+# Files under these prefixes never change once written: processed outputs,
+# previews and HLS packages are named by content key, uploads and their
+# proxies/sprites by the upload's uuid, generated images by a per-image uuid
+IMMUTABLE_PREFIXES = ("processed/", "previews/", "uploads/", "proxies/", "thumbnails/", "generated_images/")
+
+# Text assets worth precompressing (media is already compressed)
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".json", ".html", ".txt", ".m3u8")
+ASSET_DIRS = ("css", "js")
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def cache_control_for(path, versioned=False):
+    """Cache-Control value for a path relative to the static root"""
+    path = path.replace("\\", "/")
+    if versioned or path.startswith(IMMUTABLE_PREFIXES):
+        return IMMUTABLE
+    return REVALIDATE
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def file_version(full_path):
+    """Short content hash of a file, recomputed only when its size or mtime changes"""
+    stat_result = os.stat(full_path)
+    signature = (stat_result.st_mtime_ns, stat_result.st_size)
+    with _versions_lock:
+        cached = _versions.get(full_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with open(full_path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:VERSION_LENGTH]
+    with _versions_lock:
+        _versions[full_path] = (signature, digest)
+    return digest
+
+
+def _accepted_encodings(scope):
+    accepted = set()
+    for name, value in scope.get("headers", []):
+        if name != b"accept-encoding":
+            continue
+        for token in value.decode("latin-1").split(","):
+            coding, _, params = token.strip().partition(";")
+            if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class MediaStaticFiles(StaticFiles):
+    """StaticFiles that adds Cache-Control headers per path and serves precompressed variants"""
+
+    def static_url(self, path):
+        """Versioned URL for a file under the static root (a Jinja global in templates)"""
+        path = path.lstrip("/")
+        full_path = os.path.join(self.directory, path)
+        try:
+            return f"{STATIC_URL_PREFIX}{path}?v={file_version(full_path)}"
+        except OSError:
+            return f"{STATIC_URL_PREFIX}{path}"
+
+    def _is_current_version(self, full_path, scope):
+        requested = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("v")
+        # A stale version must not be cached forever against the new content
+        return bool(requested) and requested[0] == file_version(full_path)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        path = self.get_path(scope)
+        served_path, encoding = full_path, None
+        if str(full_path).endswith(COMPRESSIBLE_EXTENSIONS):
+            accepted = _accepted_encodings(scope)
+            for name, suffix in ENCODINGS:
+                variant = f"{full_path}{suffix}"
+                if name in accepted and os.path.isfile(variant) and os.stat(variant).st_mtime >= stat_result.st_mtime:
+                    served_path, encoding = variant, name
+                    stat_result = os.stat(variant)
+                    break
+
+        response = super().file_response(served_path, stat_result, scope, status_code)
+        if str(full_path).endswith(COMPRESSIBLE_EXTENSIONS):
+            response.headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            media_type = mimetypes.guess_type(str(full_path))[0] or "application/octet-stream"
+            if media_type.startswith("text/") or media_type.endswith("javascript"):
+                media_type += "; charset=utf-8"
+            response.headers["Content-Type"] = media_type
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Cache-Control"] = cache_control_for(path, self._is_current_version(full_path, scope))
+        return response
+
+
+def precompress(directory, subdirs=ASSET_DIRS):
+    """Write .gz (and .br when brotli is installed) next to each text asset; returns files written"""
+    written = 0
+    for subdir in subdirs:
+        for source in sorted(Path(directory, subdir).rglob("*")):
+            if not source.is_file() or not source.name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            data = None
+            for name, suffix in ENCODINGS:
+                if name == "br" and brotli is None:
+                    continue
+                target = source.with_name(source.name + suffix)
+                if target.exists() and target.stat().st_mtime >= source.stat().st_mtime:
+                    continue
+                if data is None:
+                    data = source.read_bytes()
+                compressed = brotli.compress(data, quality=11) if name == "br" else gzip.compress(data, compresslevel=9, mtime=0)
+                # Not worth a variant if it doesn't shrink the file
+                if len(compressed) >= len(data):
+                    continue
+                tmp = target.with_name(target.name + ".tmp")
+                tmp.write_bytes(compressed)
+                os.replace(tmp, target)
+                written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Static asset build steps")
+    parser.add_argument("--compress", action="store_true", help="write precompressed .br/.gz variants of css/js")
+    parser.add_argument("--directory", default="static")
+    args = parser.parse_args()
+    if args.compress:
+        print(f"Wrote {precompress(args.directory)} compressed variants")
+
+
+if __name__ == "__main__":
+    main()
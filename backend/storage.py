@@ -0,0 +1,196 @@
+"""
+Media storage backends
+Generated images, uploads and processed videos are always written to a local
+working copy under static/ first (ffmpeg and Pillow need real files); the
+storage backend decides where the published copy lives and which URL the
+client gets for it:
+    STORAGE_BACKEND=local   files stay in static/ and are served by the app at /static/...
+    STORAGE_BACKEND=s3      files are uploaded to an S3-compatible bucket (AWS, MinIO, R2, ...)
+                            and clients download them directly from there
+
+With S3 the URL is S3_PUBLIC_BASE_URL/<key> when set (public bucket or CDN),
+otherwise a presigned GET valid for S3_URL_EXPIRES seconds. HLS playlists
+refer to their segments by relative path, which a presigned URL can't carry,
+so without a public base URL playlists are served by the app instead.
+
+Paths stored in the database stay "static/..." either way; the object key is
+the same path without the "static/" prefix (plus S3_PREFIX).
+"""
+
+import logging
+import mimetypes
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_PUBLIC_BASE_URL = os.getenv("S3_PUBLIC_BASE_URL", "").rstrip("/")
+S3_URL_EXPIRES = int(os.getenv("S3_URL_EXPIRES", "3600"))
+
+LOCAL_ROOT = "static"
+# Every media path is unique (uuid or content hash), so published objects never change
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _relative(path):
+    """'static/generated_images/a.webp' -> 'generated_images/a.webp'"""
+    path = path.replace(os.sep, "/")
+    prefix = LOCAL_ROOT + "/"
+    return path[len(prefix):] if path.startswith(prefix) else path.lstrip("/")
+
+
+class LocalStorage:
+    """Media served by the app from the static/ directory"""
+
+    name = "local"
+
+    def put(self, path):
+        # The working copy already is the published file
+        return path
+
+    def put_dir(self, directory):
+        return directory
+
+    def url(self, path):
+        return f"/{LOCAL_ROOT}/{_relative(path)}" if path else None
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def ensure_local(self, path):
+        """Path of a readable local copy; FileNotFoundError if the media is gone"""
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        return path
+
+    def open(self, path):
+        return open(path, "rb")
+
+    def delete(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete_dir(self, directory):
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class S3Storage(LocalStorage):
+    """Media published to an S3-compatible bucket; the local copy is only a working cache"""
+
+    name = "s3"
+
+    def __init__(self, bucket, endpoint_url=None, region=S3_REGION, prefix="", public_base_url="",
+                 url_expires=S3_URL_EXPIRES, client=None):
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set when STORAGE_BACKEND=s3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.public_base_url = public_base_url.rstrip("/")
+        self.url_expires = url_expires
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            client = boto3.client(
+                "s3", endpoint_url=endpoint_url, region_name=region,
+                config=Config(signature_version="s3v4", retries={"max_attempts": 3, "mode": "standard"}),
+            )
+        self.client = client
+
+    def key(self, path):
+        relative = _relative(path)
+        return f"{self.prefix}/{relative}" if self.prefix else relative
+
+    def put(self, path):
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.client.upload_file(path, self.bucket, self.key(path), ExtraArgs={
+            "ContentType": content_type, "CacheControl": MEDIA_CACHE_CONTROL,
+        })
+        return path
+
+    def put_dir(self, directory):
+        for root, _, files in os.walk(directory):
+            for name in files:
+                self.put(os.path.join(root, name))
+        return directory
+
+    def url(self, path):
+        if not path:
+            return None
+        if self.public_base_url:
+            return f"{self.public_base_url}/{self.key(path)}"
+        if path.endswith(".m3u8"):
+            # Relative segment references can't be presigned; the app serves the playlist set
+            return super().url(path)
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.key(path)}, ExpiresIn=self.url_expires)
+
+    def exists(self, path):
+        from botocore.exceptions import ClientError
+        if os.path.exists(path):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(path))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def ensure_local(self, path):
+        """Download the object when this node has no working copy (e.g. another node produced it)"""
+        from botocore.exceptions import ClientError
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.download"
+        try:
+            self.client.download_file(self.bucket, self.key(path), tmp_path)
+        except ClientError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise FileNotFoundError(path) from e
+        os.replace(tmp_path, path)
+        return path
+
+    def open(self, path):
+        if os.path.exists(path):
+            return open(path, "rb")
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(path))["Body"]
+        except ClientError as e:
+            raise FileNotFoundError(path) from e
+
+    def delete(self, path):
+        removed = super().delete(path)
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(path))
+        return removed
+
+    def delete_dir(self, directory):
+        super().delete_dir(directory)
+        prefix = self.key(directory).rstrip("/") + "/"
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys, "Quiet": True})
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "local":
+        return LocalStorage()
+    if backend == "s3":
+        return S3Storage(S3_BUCKET, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION, prefix=S3_PREFIX,
+                         public_base_url=S3_PUBLIC_BASE_URL, url_expires=S3_URL_EXPIRES)
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r} (expected local or s3)")
+
+
+storage = create_storage()
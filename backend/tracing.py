@@ -0,0 +1,297 @@
+"""
+Request tracing
+Every HTTP request gets a request id (X-Request-ID, taken from the client
+when present) and a root span; code on the request path opens nested spans
+with `with tracing.span("name", key=value):`. The current span lives in a
+contextvar, so spans follow the request into threadpool endpoints and
+asyncio.to_thread calls.
+
+Finished traces are kept in a small in-memory ring (see /api/admin/traces)
+and optionally exported:
+    TRACE_EXPORT=json   one JSON object per trace appended to TRACE_FILE
+    TRACE_EXPORT=otlp   OTLP/HTTP JSON posted to OTLP_ENDPOINT (e.g. a local collector)
+Exports happen on a background thread; requests never wait for them.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from . import profiling
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "").lower()  # "", "json" or "otlp"
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.ndjson")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+SERVICE_NAME = os.getenv("SERVICE_NAME", "project-nova")
+# Finished traces kept in memory for the admin endpoint
+RECENT_TRACES = int(os.getenv("TRACE_RECENT", "200"))
+# Spans per trace beyond this are dropped (a runaway loop must not eat memory)
+MAX_SPANS_PER_TRACE = 1000
+EXPORT_QUEUE_SIZE = 1000
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            "name": self.name, "span_id": self.span_id, "parent_id": self.parent_id,
+            "start_ns": self.start_ns, "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes, "error": self.error,
+        }
+
+
+class Trace:
+    def __init__(self, request_id):
+        self.request_id = request_id
+        # OTLP wants a 32-hex trace id; client-supplied request ids can be anything
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS_PER_TRACE:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        root = spans[0] if spans else None
+        return {
+            "request_id": self.request_id, "trace_id": self.trace_id,
+            "name": root.name if root else None,
+            "duration_ms": round(root.duration_ms, 3) if root else None,
+            "spans": [s.to_dict() for s in spans], "dropped_spans": self.dropped,
+        }
+
+
+@contextmanager
+def span(name, **attributes):
+    """Open a child span of the current one; a no-op outside a traced request"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        current.trace.add(current)
+
+
+def instrument_engine(sync_engine):
+    """Open a db.query span around every statement run on the engine"""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_span.get() is None:
+            return
+        cm = span("db.query", statement=statement.strip()[:200])
+        cm.__enter__()
+        conn.info.setdefault("tracing_spans", []).append(cm)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("tracing_spans")
+        if stack:
+            stack.pop().__exit__(None, None, None)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _on_error(exception_context):
+        conn = exception_context.connection
+        stack = conn.info.get("tracing_spans") if conn is not None else None
+        if stack:
+            e = exception_context.original_exception
+            stack.pop().__exit__(type(e), e, e.__traceback__)
+
+
+def current_request_id():
+    current = _current_span.get()
+    return current.trace.request_id if current else None
+
+
+class _RecentTraces:
+    """Most recent finished traces, by request id"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        with self._lock:
+            self._items[trace.request_id] = trace
+            self._items.move_to_end(trace.request_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get(self, request_id):
+        with self._lock:
+            return self._items.get(request_id)
+
+    def latest(self, limit):
+        with self._lock:
+            return list(self._items.values())[-limit:][::-1]
+
+
+recent_traces = _RecentTraces(RECENT_TRACES)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(traces):
+    """OTLP/HTTP JSON body for a batch of traces"""
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            attributes = dict(s.attributes, **{"request.id": trace.request_id})
+            spans.append({
+                "traceId": trace.trace_id, "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "", "name": s.name,
+                "kind": 2 if s.parent_id is None else 1,  # SERVER for the root, INTERNAL below
+                "startTimeUnixNano": str(s.start_ns), "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+    }]}
+
+
+class _Exporter:
+    """Background thread that writes or posts finished traces in batches"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            pass  # shed traces rather than slow requests down
+
+    def _run(self):
+        client = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.mode == "json":
+                    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                        for trace in batch:
+                            f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+                elif self.mode == "otlp":
+                    import httpx
+                    client = client or httpx.Client(timeout=5)
+                    client.post(OTLP_ENDPOINT, json=to_otlp(batch))
+            except Exception as e:
+                logger.warning(f"Trace export failed: {e}")
+
+
+_exporter = _Exporter(TRACE_EXPORT) if TRACE_EXPORT in ("json", "otlp") else None
+
+
+def _finish(trace):
+    recent_traces.add(trace)
+    if _exporter is not None:
+        _exporter.submit(trace)
+
+
+class TracingMiddleware:
+    """Root span and request id for every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+        trace = Trace(request_id or uuid.uuid4().hex)
+        root = Span(trace, f"{scope['method']} {scope['path']}", None,
+                    {"http.method": scope["method"], "http.target": scope["path"]})
+        token = _current_span.set(root)
+        profiler = profiling.start_for(scope["path"])
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                root.set("http.status_code", message["status"])
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", trace.request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            root.end_ns = time.time_ns()
+            _current_span.reset(token)
+            if profiler is not None:
+                root.set("profile_id", profiling.finish(profiler, trace.request_id, scope["path"], root.duration_ms))
+            trace.add(root)
+            _finish(trace)
@@ -0,0 +1,223 @@
+"""
+Processing cache for the video editor
+Outputs are keyed by (source content hash, normalized filtergraph, profile) so
+reapplying an effect to the same upload returns the existing file.
+
+Effect previews are grouped per source under static/previews/<source hash>/;
+they go when the last task with that source is deleted, and any preview not
+used for PREVIEW_TTL_HOURS is swept.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from . import models
+from .storage import storage
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_DIR = "static/processed"
+HLS_DIR = os.path.join(PROCESSED_DIR, "hls")
+PREVIEW_DIR = "static/previews"
+HASH_CHUNK_SIZE = 1024 * 1024
+# Previews unused for this long are deleted (0 disables the sweep)
+PREVIEW_TTL_HOURS = float(os.getenv("PREVIEW_TTL_HOURS", "24"))
+PREVIEW_SWEEP_INTERVAL_SECONDS = 3600
+
+# Serializes claiming a cached output against releasing it (per process)
+_reference_lock = threading.Lock()
+
+
+class HashingWriter:
+    """Write a stream to disk while hashing it, so the hash costs no extra read"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._hash = hashlib.sha256()
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def close(self):
+        self._file.close()
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def hash_file(path):
+    """Hash an existing file (only used for uploads that predate the cache)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_filtergraph(video_filter, start=None, end=None):
+    """Canonical text form of a job so equivalent requests share a key"""
+    graph = (video_filter or "null").strip()
+    # Separators never need surrounding whitespace in an ffmpeg filtergraph
+    graph = re.sub(r"\s*([,;:=])\s*", r"\1", graph)
+    if start or end is not None:
+        trim_end = "" if end is None else f"{float(end):.3f}"
+        graph += f"|trim={float(start or 0):.3f}:{trim_end}"
+    return graph
+
+
+def cache_key(source_hash, filtergraph, profile):
+    """Stable key for a processing job"""
+    raw = f"{source_hash}|{filtergraph}|{profile}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def output_path_for(key, source_path):
+    """Path of the cached output for a key (keeps the source container extension)"""
+    ext = os.path.splitext(source_path)[1] or ".mp4"
+    return os.path.join(PROCESSED_DIR, f"{key}{ext}")
+
+
+def lookup(key, source_path):
+    """Return the cached output path if it has already been produced (here or on another node)"""
+    path = output_path_for(key, source_path)
+    if os.path.exists(path):
+        return path if os.path.getsize(path) > 0 else None
+    return path if storage.exists(path) else None
+
+
+def hls_dir_for(output_path):
+    """Directory holding the HLS packaging of a cached output"""
+    key = os.path.splitext(os.path.basename(output_path))[0]
+    return os.path.join(HLS_DIR, key)
+
+
+def hls_master_for(output_path):
+    """Master playlist of a cached output, if it has been packaged"""
+    master = os.path.join(hls_dir_for(output_path), "master.m3u8")
+    return master if os.path.exists(master) else None
+
+
+def temp_path_for(final_path):
+    """Scratch path next to the final output; renamed into place when complete"""
+    root, ext = os.path.splitext(final_path)
+    return f"{root}.tmp-{uuid.uuid4().hex[:8]}{ext}"
+
+
+def commit_output(temp_path, final_path):
+    """Atomically publish a finished output so readers never see a partial file"""
+    try:
+        os.replace(temp_path, final_path)
+    except OSError:
+        # Lost a race with an identical job (non-empty target dir); its output is equivalent
+        if not os.path.exists(final_path):
+            raise
+
+
+def ref_count(db, path):
+    """Number of video tasks currently pointing at an output"""
+    return db.query(models.VideoTask).filter(models.VideoTask.output_video == path).count()
+
+
+def claim(db, task, path):
+    """Point a task at a cached output and commit, unless the output was released meanwhile
+
+    Runs under the same lock as release(), so once this returns True the new
+    reference is committed and no release in this process can delete the
+    file on the strength of an older count. Returns False if the output is
+    gone; the caller should produce it again.
+    """
+    with _reference_lock:
+        if not (os.path.exists(path) or storage.exists(path)):
+            return False
+        task.output_video = path
+        db.commit()
+        return True
+
+
+def release(db, path):
+    """Delete a cached output once no VideoTask references it any more
+
+    Call after the referencing task has been changed or deleted (and committed).
+    """
+    if not path:
+        return False
+    with _reference_lock:
+        if ref_count(db, path) > 0:
+            return False
+        storage.delete_dir(hls_dir_for(path))
+        removed = storage.delete(path)
+    if removed:
+        logger.info(f"Removed unreferenced processed video {path}")
+    return removed
+
+
+def preview_path_for(source_hash, key):
+    return os.path.join(PREVIEW_DIR, source_hash, f"{key}.mp4")
+
+
+def touch_preview(path):
+    """Mark a preview as used so the sweep measures age from its last use"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def release_previews(db, source_hash):
+    """Delete a source's previews once no VideoTask uses that source any more"""
+    if not source_hash:
+        return False
+    if db.query(models.VideoTask).filter(models.VideoTask.source_hash == source_hash).count() > 0:
+        return False
+    storage.delete_dir(os.path.join(PREVIEW_DIR, source_hash))
+    return True
+
+
+def sweep_previews(max_age_seconds, now=None):
+    """Delete previews not used for max_age_seconds; returns how many were removed"""
+    cutoff = (now or time.time()) - max_age_seconds
+    removed = 0
+    for root, _, files in os.walk(PREVIEW_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            storage.delete(path)
+            removed += 1
+    # Drop per-source directories the sweep emptied
+    for root, dirs, files in os.walk(PREVIEW_DIR, topdown=False):
+        if root != PREVIEW_DIR and not dirs and not files:
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+    if removed:
+        logger.info(f"Swept {removed} video previews older than {max_age_seconds / 3600:g}h")
+    return removed
+
+
+async def sweep_previews_periodically(ttl_hours=PREVIEW_TTL_HOURS, interval=PREVIEW_SWEEP_INTERVAL_SECONDS):
+    """Background loop started by the app"""
+    while True:
+        try:
+            await asyncio.to_thread(sweep_previews, ttl_hours * 3600)
+        except Exception as e:
+            logger.error(f"Preview sweep failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,75 @@
+"""
+Benchmark the verified-token user cache
+
+Runs the auth and chat routers in-process against a throwaway SQLite database
+and compares /api/chat/history latency with the cache disabled and enabled.
+
+Usage:
+    python benchmark_auth_cache.py [--requests 2000] [--history-rows 20]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--history-rows", type=int, default=20)
+    args = parser.parse_args()
+
+    # The database URL is relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="bench_auth_")
+    os.chdir(workdir)
+    sys.path.insert(0, BASE_DIR)
+
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from backend import auth, database, models
+    from backend.routers import auth as auth_router, chat as chat_router
+
+    database.Base.metadata.create_all(bind=database.engine)
+    app = FastAPI()
+    app.include_router(auth_router.router, prefix="/api/auth")
+    app.include_router(chat_router.router, prefix="/api/chat")
+    client = TestClient(app)
+
+    client.post("/api/auth/register", json={"username": "bench", "email": "bench@example.com", "password": "pw"})
+    token = client.post("/api/auth/token", json={"email": "bench@example.com", "password": "pw"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    db = database.SessionLocal()
+    user = db.query(models.User).filter(models.User.username == "bench").first()
+    db.add_all(models.ChatHistory(user_id=user.id, message=f"message {i}", role="user") for i in range(args.history_rows))
+    db.commit()
+    db.close()
+
+    ttl = auth.principal_cache.ttl
+    for label, cache_ttl in (("cache off", 0), ("cache on", ttl or 60)):
+        auth.principal_cache.clear()
+        auth.principal_cache.ttl = cache_ttl
+        for _ in range(50):  # warm-up
+            client.get("/api/chat/history", headers=headers)
+        samples = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            response = client.get("/api/chat/history", headers=headers)
+            samples.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200
+        print(f"{label:<10} p50={statistics.median(samples):6.3f} ms  p95={percentile(samples, 95):6.3f} ms  "
+              f"p99={percentile(samples, 99):6.3f} ms  ({args.requests} requests)")
+
+
+if __name__ == "__main__":
+    main()
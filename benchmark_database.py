@@ -0,0 +1,134 @@
+"""
+Mixed read/write database benchmark
+
+Writer threads insert chat messages (one commit each) while reader threads
+page through a user's history, first with SQLite's default settings and then
+with the tuned pragmas from backend.database. Reports throughput and latency
+for both sides.
+
+Usage:
+    python benchmark_database.py [--seconds 10] [--writers 4] [--readers 8]
+
+--url points the benchmark at another database instead. It DROPS AND
+RECREATES ALL APP TABLES there, so it must be a scratch database and needs
+--i-know-this-drops-tables:
+    python benchmark_database.py --url postgresql://localhost/bench_scratch --i-know-this-drops-tables
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from backend import database, models
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def run(url, pragmas, seconds, writers, readers, seed_rows):
+    engine = database.create_db_engine(url, sqlite_pragmas=pragmas)
+    database.Base.metadata.drop_all(bind=engine)
+    database.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    with Session() as db:
+        user = models.User(username="bench", email="bench@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+        db.add_all(models.ChatHistory(user_id=user_id, message=f"seed {i}", role="user") for i in range(seed_rows))
+        db.commit()
+
+    stop = threading.Event()
+    results = {"write": [], "read": [], "errors": 0}
+    lock = threading.Lock()
+
+    def writer():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with Session() as db:
+                    db.add(models.ChatHistory(user_id=user_id, message="hello " * 20, role="user"))
+                    db.commit()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    results["write"].append(elapsed)
+            except Exception:
+                with lock:
+                    results["errors"] += 1
+
+    def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with Session() as db:
+                    (db.query(models.ChatHistory)
+                       .filter(models.ChatHistory.user_id == user_id)
+                       .order_by(models.ChatHistory.id.desc())
+                       .limit(50).all())
+                elapsed = time.perf_counter() - started
+                with lock:
+                    results["read"].append(elapsed)
+            except Exception:
+                with lock:
+                    results["errors"] += 1
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    engine.dispose()
+    return results
+
+
+def report(label, results, seconds):
+    print(label)
+    for kind in ("write", "read"):
+        samples = [s * 1000 for s in results[kind]]
+        if not samples:
+            print(f"  {kind:<5} no completed operations")
+            continue
+        print(f"  {kind:<5} {len(samples) / seconds:8.1f} ops/s  p50={statistics.median(samples):7.2f} ms  "
+              f"p95={percentile(samples, 95):7.2f} ms  p99={percentile(samples, 99):7.2f} ms")
+    print(f"  errors {results['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seed-rows", type=int, default=5000)
+    parser.add_argument("--url", help="scratch database URL; all app tables in it are dropped "
+                                      "(default: a temporary SQLite file)")
+    parser.add_argument("--i-know-this-drops-tables", dest="allow_drop", action="store_true",
+                        help="confirm that --url may be wiped")
+    args = parser.parse_args()
+    if args.url and not args.allow_drop:
+        parser.error("--url drops and recreates every app table in that database; "
+                     "pass --i-know-this-drops-tables if it is a scratch database")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configs = [("default settings", {"journal_mode": "DELETE", "synchronous": "FULL"}),
+                   ("tuned pragmas", database.SQLITE_PRAGMAS)]
+        for i, (label, pragmas) in enumerate(configs):
+            url = args.url or f"sqlite:///{os.path.join(tmp, f'bench_{i}.db')}"
+            results = run(url, pragmas, args.seconds, args.writers, args.readers, args.seed_rows)
+            report(f"{label} ({url})", results, args.seconds)
+            if not url.startswith("sqlite"):
+                break  # pragmas only apply to SQLite
+
+
+if __name__ == "__main__":
+    main()
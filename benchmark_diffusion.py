@@ -0,0 +1,200 @@
+"""
+Stage-level microbenchmark for the diffusion pipeline
+
+Times the parts of one pipe(...) call separately by hooking the pipeline's
+components: text encoding, UNet (per step), scheduler step overhead and VAE
+decode; whatever is left (latent prep, image post-processing) is "other".
+Sweeps resolution, step count and torch thread count. Every configuration
+runs in its own subprocess so its peak RSS is measured in isolation.
+
+--model tiny (default) builds a tiny randomly initialized pipeline locally,
+so no download or network access is needed. --model configured loads the
+app's real pipeline through model_manager.
+
+Usage:
+    python benchmark_diffusion.py [--model tiny] [--resolutions 64,128] [--steps 1,4] [--threads 1,2] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _tiny_tokenizer(directory):
+    """CLIP tokenizer with a byte-level vocabulary and no merges, written locally"""
+    from transformers import CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    chars = list(bytes_to_unicode().values())
+    tokens = chars + [c + "</w>" for c in chars] + ["<|startoftext|>", "<|endoftext|>"]
+    vocab_path = os.path.join(directory, "vocab.json")
+    merges_path = os.path.join(directory, "merges.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        json.dump({t: i for i, t in enumerate(tokens)}, f)
+    with open(merges_path, "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(vocab_path, merges_path), len(tokens)
+
+
+def build_tiny_pipeline():
+    """Randomly initialized Stable Diffusion pipeline small enough for CI"""
+    import torch
+    from diffusers import AutoencoderKL, LCMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    torch.manual_seed(0)
+    tokenizer, vocab_size = _tiny_tokenizer(tempfile.mkdtemp(prefix="tiny_clip_"))
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        vocab_size=vocab_size, hidden_size=32, intermediate_size=37, num_hidden_layers=2,
+        num_attention_heads=4, max_position_embeddings=77, projection_dim=32,
+        bos_token_id=vocab_size - 2, eos_token_id=vocab_size - 1, pad_token_id=vocab_size - 1,
+    ))
+    unet = UNet2DConditionModel(
+        sample_size=32, in_channels=4, out_channels=4, layers_per_block=1,
+        block_out_channels=(32, 64), cross_attention_dim=32, attention_head_dim=8,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+    )
+    vae = AutoencoderKL(
+        in_channels=3, out_channels=3, latent_channels=4, block_out_channels=(32, 64),
+        down_block_types=("DownEncoderBlock2D", "DownEncoderBlock2D"),
+        up_block_types=("UpDecoderBlock2D", "UpDecoderBlock2D"),
+    )
+    scheduler = LCMScheduler(beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear")
+    return StableDiffusionPipeline(
+        vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, unet=unet, scheduler=scheduler,
+        safety_checker=None, feature_extractor=None, requires_safety_checker=False,
+    )
+
+
+def build_configured_pipeline():
+    sys.path.insert(0, BASE_DIR)
+    from backend import model_manager
+    pipe = model_manager.load_stable_diffusion()
+    if pipe is None:
+        raise SystemExit("The configured pipeline could not be loaded (see log above)")
+    return pipe
+
+
+class StageTimer:
+    """Accumulates wall time per stage via module hooks and method wrappers"""
+
+    def __init__(self, pipe):
+        import torch
+        self._sync = torch.cuda.synchronize if pipe.device.type == "cuda" else (lambda: None)
+        self.times = {"text_encoder": [], "unet": [], "scheduler": [], "vae_decode": []}
+        self._started = {}
+        for stage, module in (("text_encoder", pipe.text_encoder), ("unet", pipe.unet)):
+            module.register_forward_pre_hook(self._pre(stage))
+            module.register_forward_hook(self._post(stage))
+        pipe.scheduler.step = self._wrap("scheduler", pipe.scheduler.step)
+        pipe.vae.decode = self._wrap("vae_decode", pipe.vae.decode)
+
+    def reset(self):
+        for samples in self.times.values():
+            samples.clear()
+
+    def _pre(self, stage):
+        def hook(module, args):
+            self._sync()
+            self._started[stage] = time.perf_counter()
+        return hook
+
+    def _post(self, stage):
+        def hook(module, args, output):
+            self._sync()
+            self.times[stage].append(time.perf_counter() - self._started.pop(stage))
+        return hook
+
+    def _wrap(self, stage, func):
+        def wrapper(*args, **kwargs):
+            self._sync()
+            started = time.perf_counter()
+            result = func(*args, **kwargs)
+            self._sync()
+            self.times[stage].append(time.perf_counter() - started)
+            return result
+        return wrapper
+
+
+def run_config(config):
+    """Child process: time one (model, resolution, steps, threads) configuration"""
+    import torch
+    torch.set_num_threads(config["threads"])
+    pipe = build_tiny_pipeline() if config["model"] == "tiny" else build_configured_pipeline()
+    pipe.set_progress_bar_config(disable=True)
+    timer = StageTimer(pipe)
+    size = config["resolution"]
+    kwargs = dict(num_inference_steps=config["steps"], height=size, width=size, guidance_scale=1.0)
+
+    pipe("warm-up", **kwargs)
+    totals, stages = [], {stage: [] for stage in timer.times}
+    for i in range(config["repeat"]):
+        timer.reset()
+        started = time.perf_counter()
+        pipe(f"a red cube on a table {i}", generator=torch.Generator().manual_seed(i), **kwargs)
+        totals.append(time.perf_counter() - started)
+        for stage, samples in timer.times.items():
+            stages[stage].append(sum(samples))
+
+    result = dict(config)
+    result["total_ms"] = round(statistics.median(totals) * 1000, 2)
+    for stage, samples in stages.items():
+        result[f"{stage}_ms"] = round(statistics.median(samples) * 1000, 2)
+    result["unet_per_step_ms"] = round(result["unet_ms"] / config["steps"], 2)
+    result["other_ms"] = round(result["total_ms"] - sum(result[f"{s}_ms"] for s in stages), 2)
+    # ru_maxrss is KiB on Linux
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=("tiny", "configured"), default="tiny")
+    parser.add_argument("--resolutions", default="64,128", help="comma-separated square sizes (multiples of 8)")
+    parser.add_argument("--steps", default="1,4", help="comma-separated inference step counts")
+    parser.add_argument("--threads", default=str(os.cpu_count() or 1), help="comma-separated torch thread counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", metavar="PATH", help="save results as JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_config(json.loads(args.child))))
+        return
+
+    results = []
+    for resolution in (int(v) for v in args.resolutions.split(",")):
+        for steps in (int(v) for v in args.steps.split(",")):
+            for threads in (int(v) for v in args.threads.split(",")):
+                config = {"model": args.model, "resolution": resolution, "steps": steps,
+                          "threads": threads, "repeat": args.repeat}
+                child = subprocess.run([sys.executable, __file__, "--child", json.dumps(config)],
+                                       capture_output=True, text=True)
+                if child.returncode != 0:
+                    print(child.stderr, file=sys.stderr)
+                    raise SystemExit(f"Configuration {config} failed")
+                result = json.loads(child.stdout.strip().splitlines()[-1])
+                results.append(result)
+                print(f"{resolution:>4}px {steps:>2} steps {threads:>2} threads: total {result['total_ms']:>9} ms | "
+                      f"text {result['text_encoder_ms']:>7} | unet {result['unet_ms']:>9} "
+                      f"({result['unet_per_step_ms']}/step) | sched {result['scheduler_ms']:>6} | "
+                      f"vae {result['vae_decode_ms']:>8} | other {result['other_ms']:>7} | "
+                      f"rss {result['peak_rss_mb']} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {args.json}")
+
+
+if __name__ == "__main__":
+    main()
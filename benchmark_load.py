@@ -0,0 +1,275 @@
+"""
+End-to-end load test with deterministic local stand-ins
+
+Starts the full app in-process (uvicorn on a local port, throwaway SQLite
+database) with fake providers in place of the real ones:
+  - a Gemini stub that answers after --gemini-latency-ms
+  - a fake diffusion pipeline that sleeps --step-ms per inference step and
+    returns a flat image derived from the prompt
+  - real ffmpeg on a generated test clip for the video editor
+Virtual users register, log in and then run a weighted mix of chat, history,
+image and video requests. Reports throughput and p50/p95/p99 per endpoint.
+
+Usage:
+    python benchmark_load.py [--users 10] [--duration 30] [--json results.json]
+    python benchmark_load.py --json new.json --compare old.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Relative weights of each workload step
+DEFAULT_MIX = {"chat": 3, "history": 5, "image": 1, "video": 1}
+VIDEO_PROMPTS = ("black and white", "mirror", "make it pop")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def install_fake_gemini(latency_s):
+    """Register a google.generativeai stand-in that answers after a fixed delay"""
+    genai = types.ModuleType("google.generativeai")
+
+    class GenerativeModel:
+        def __init__(self, model_name="gemini-2.5-flash", **kwargs):
+            self.model_name = model_name
+
+        def _reply(self, prompt):
+            return types.SimpleNamespace(text=f"[{self.model_name}] {str(prompt)[:80]}")
+
+        def generate_content(self, prompt, **kwargs):
+            time.sleep(latency_s)
+            return self._reply(prompt)
+
+        async def generate_content_async(self, prompt, **kwargs):
+            await asyncio.sleep(latency_s)
+            return self._reply(prompt)
+
+    genai.GenerativeModel = GenerativeModel
+    genai.configure = lambda **kwargs: None
+    genai.list_models = lambda: []
+    try:
+        import google
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    google.generativeai = genai
+    sys.modules["google.generativeai"] = genai
+
+
+class FakeDiffusionPipeline:
+    """Diffusion stand-in: fixed time per step, deterministic output per prompt"""
+
+    device = types.SimpleNamespace(type="cpu")
+
+    def __init__(self, step_s):
+        self.step_s = step_s
+
+    def __call__(self, prompt, num_inference_steps=4, **kwargs):
+        from PIL import Image
+        time.sleep(self.step_s * num_inference_steps)
+        seed = zlib.crc32(prompt.encode("utf-8"))
+        color = (seed & 0xFF, (seed >> 8) & 0xFF, (seed >> 16) & 0xFF)
+        return types.SimpleNamespace(images=[Image.new("RGB", (512, 512), color)])
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name, elapsed_ms, ok):
+        self.latencies.setdefault(name, []).append(elapsed_ms)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+
+async def timed(stats, name, request):
+    started = time.perf_counter()
+    try:
+        response = await request
+        ok = response.status_code < 400
+    except Exception:
+        response, ok = None, False
+    stats.record(name, (time.perf_counter() - started) * 1000, ok)
+    return response
+
+
+async def virtual_user(client, index, deadline, mix, stats, clip, seed):
+    rng = random.Random(seed + index)
+    name = f"load{index}"
+    await timed(stats, "register", client.post(
+        "/api/auth/register", json={"username": name, "email": f"{name}@example.com", "password": "pw"}))
+    response = await timed(stats, "login", client.post(
+        "/api/auth/token", json={"email": f"{name}@example.com", "password": "pw"}))
+    if response is None or response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    steps, weights = zip(*mix.items())
+
+    while time.perf_counter() < deadline:
+        step = rng.choices(steps, weights)[0]
+        if step == "chat":
+            await timed(stats, "chat", client.post(
+                "/api/chat", json={"message": f"question {rng.randrange(1000)}"}, headers=headers))
+        elif step == "history":
+            await timed(stats, "history", client.get("/api/chat/history?limit=50", headers=headers))
+        elif step == "image":
+            await timed(stats, "image", client.post(
+                "/api/image/generate", json={"prompt": f"a {rng.choice(['red', 'blue', 'green'])} cube"}, headers=headers))
+        elif step == "video":
+            with open(clip, "rb") as f:
+                upload = await timed(stats, "video_upload", client.post(
+                    "/api/video/upload", files={"file": ("clip.mp4", f.read(), "video/mp4")},
+                    data={"prompt": "edit"}, headers=headers))
+            if upload is not None and upload.status_code == 200:
+                await timed(stats, "video_process", client.post(
+                    f"/api/video/process/{upload.json()['id']}",
+                    json={"prompt": rng.choice(VIDEO_PROMPTS), "profile": "fast"}, headers=headers))
+
+
+def start_server(app):
+    import uvicorn
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Server failed to start")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def drive(base_url, args, mix, clip):
+    import httpx
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(virtual_user(client, i, deadline, mix, stats, clip, args.seed) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+    return stats, elapsed
+
+
+def summarize(stats, elapsed, args, mix):
+    endpoints = {}
+    for name, samples in sorted(stats.latencies.items()):
+        endpoints[name] = {
+            "count": len(samples),
+            "errors": stats.errors.get(name, 0),
+            "throughput_rps": round(len(samples) / elapsed, 2),
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "p99_ms": round(percentile(samples, 99), 2),
+        }
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    total = sum(e["count"] for e in endpoints.values())
+    return {
+        "commit": commit,
+        "config": {"users": args.users, "duration_s": args.duration, "gemini_latency_ms": args.gemini_latency_ms,
+                   "step_ms": args.step_ms, "seed": args.seed, "mix": mix},
+        "elapsed_s": round(elapsed, 2),
+        "total_requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(results, baseline=None):
+    print(f"commit {results['commit']}: {results['total_requests']} requests in {results['elapsed_s']}s "
+          f"({results['throughput_rps']} req/s)")
+    print(f"  {'endpoint':<14} {'count':>6} {'err':>4} {'req/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, e in results["endpoints"].items():
+        line = (f"  {name:<14} {e['count']:>6} {e['errors']:>4} {e['throughput_rps']:>7} "
+                f"{e['p50_ms']:>9} {e['p95_ms']:>9} {e['p99_ms']:>9}")
+        old = (baseline or {}).get("endpoints", {}).get(name)
+        if old and old["p95_ms"]:
+            line += f"   p95 {100 * (e['p95_ms'] - old['p95_ms']) / old['p95_ms']:+.1f}% vs {baseline.get('commit')}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of steady load after login")
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--step-ms", type=float, default=50, help="fake diffusion time per inference step")
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help="workload weights, e.g. chat=3,history=5,image=1,video=1")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="save results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+    mix = {k: float(v) for k, v in (item.split("=") for item in args.mix.split(",")) if float(v) > 0}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.json) if args.json else None
+
+    # Relative paths (database, uploads, outputs) land in a throwaway directory
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    os.chdir(workdir)
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        "GEMINI_API_KEY": "fake",
+        "CHAT_RETENTION_DAYS": "0",
+        "FAST_START": "1",
+        # Every virtual user comes from 127.0.0.1
+        "REGISTER_MAX_PER_IP": str(args.users * 10),
+        "LOGIN_MAX_FAILURES_PER_IP": str(args.users * 10),
+        # Long runs would otherwise hit the per-user compute quota
+        "COMPUTE_QUOTA_SECONDS": "0",
+    })
+    sys.path.insert(0, BASE_DIR)
+    install_fake_gemini(args.gemini_latency_ms / 1000)
+
+    from backend import model_manager
+    from benchmark_video_profiles import make_clip
+    model_manager._stable_diffusion_pipeline = FakeDiffusionPipeline(args.step_ms / 1000)
+    from backend.main import app
+
+    clip = os.path.join(workdir, "clip.mp4")
+    make_clip(clip, duration=4, size="640x360", gop=30)
+
+    server, thread, base_url = start_server(app)
+    try:
+        stats, elapsed = asyncio.run(drive(base_url, args, mix, clip))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    results = summarize(stats, elapsed, args, mix)
+    print_report(results, baseline)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark serializing chat history rows
+
+Serves N ChatResponse-shaped rows from in-process FastAPI apps and compares:
+  validated    response_model=list[ChatResponse] with the default JSON response (before)
+  orjson-class response_model plus an orjson default_response_class
+  direct       OrjsonResponse returned directly, skipping re-validation (after)
+and reports the compressed size of the body with the compression middleware.
+
+Usage:
+    python benchmark_serialization.py [--rows 10000] [--repeat 20] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_rows(count):
+    now = datetime.utcnow()
+    return [
+        {"id": i, "user_id": 1, "role": "user" if i % 2 else "assistant", "timestamp": now,
+         "message": f"Message {i}: a typical chat turn with a sentence or two of text in it."}
+        for i in range(count)
+    ]
+
+
+def time_requests(client, path, repeat, headers=None):
+    client.get(path, headers=headers)  # warm-up
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200
+    return statistics.median(samples), response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    sys.path.insert(0, BASE_DIR)
+
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from backend import schemas
+    from backend.compression import CompressionMiddleware
+    from backend.responses import OrjsonResponse
+
+    rows = make_rows(args.rows)
+
+    validated = FastAPI()
+    orjson_default = FastAPI(default_response_class=OrjsonResponse)
+    direct = FastAPI()
+    direct.add_middleware(CompressionMiddleware)
+
+    @validated.get("/api/history", response_model=list[schemas.ChatResponse])
+    def validated_history():
+        return rows
+
+    @orjson_default.get("/api/history", response_model=list[schemas.ChatResponse])
+    def orjson_history():
+        return rows
+
+    @direct.get("/api/history", response_model=list[schemas.ChatResponse])
+    def direct_history():
+        return OrjsonResponse(rows)
+
+    results = {"rows": args.rows}
+    for label, app in (("validated", validated), ("orjson-class", orjson_default), ("direct", direct)):
+        median, response = time_requests(TestClient(app), "/api/history", args.repeat,
+                                         headers={"Accept-Encoding": "identity"})
+        results[label] = {"median_ms": round(median, 2), "bytes": len(response.content)}
+
+    client = TestClient(direct)
+    for encoding in ("gzip", "br"):
+        median, response = time_requests(client, "/api/history", args.repeat, headers={"Accept-Encoding": encoding})
+        if response.headers.get("content-encoding") != encoding:
+            continue  # brotli not installed
+        results[f"direct+{encoding}"] = {"median_ms": round(median, 2),
+                                         "bytes": int(response.headers["content-length"])}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.rows} rows, median of {args.repeat} requests")
+    for label, result in results.items():
+        if label != "rows":
+            print(f"  {label:<14} {result['median_ms']:8.2f} ms  {result['bytes']:>10} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark the video encoding profiles
+
+Generates sample clips locally with ffmpeg's test sources, runs each effect
+through every encoding profile and reports wall time and output bitrate.
+
+Usage:
+    python benchmark_video_profiles.py [--duration 10] [--size 1280x720] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+
+from backend import video_processing
+
+EFFECTS = {
+    "grayscale": "black and white",
+    "mirror": "mirror",
+    "pop": "make it pop",
+    "trim (keyframe)": "trim",
+}
+
+
+def make_clip(path, duration, size, gop=60):
+    """Create an H.264/AAC test clip with a fixed keyframe interval"""
+    command = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "veryfast", "-g", str(gop), "-keyint_min", str(gop),
+        "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", path,
+    ]
+    subprocess.run(command, check=True)
+
+
+def run(duration, size):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.mp4")
+        make_clip(source, duration, size)
+        keyframes = video_processing.probe_keyframes(source)
+        # Second keyframe so the trim is a real cut but still aligned
+        trim_start = keyframes[1] if len(keyframes) > 1 else None
+
+        for profile in video_processing.ENCODING_PROFILES:
+            for label, prompt in EFFECTS.items():
+                output = os.path.join(tmp, f"{profile}_{label.split()[0]}.mp4")
+                start = trim_start if prompt == "trim" else None
+                elapsed = video_processing.process(source, output, prompt, profile=profile, start=start)
+                fmt = video_processing.probe_format(output)
+                results.append({
+                    "profile": profile,
+                    "effect": label,
+                    "wall_time_s": round(elapsed, 3),
+                    "bitrate_kbps": round(int(fmt.get("bit_rate", 0)) / 1000, 1),
+                    "size_kb": round(int(fmt.get("size", 0)) / 1024, 1),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=int, default=10, help="clip length in seconds")
+    parser.add_argument("--size", default="1280x720", help="clip resolution")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = run(args.duration, args.size)
+
+    print(f"{'profile':<10} {'effect':<16} {'wall (s)':>9} {'bitrate (kb/s)':>15} {'size (KB)':>10}")
+    for r in results:
+        print(f"{r['profile']:<10} {r['effect']:<16} {r['wall_time_s']:>9.3f} {r['bitrate_kbps']:>15.1f} {r['size_kb']:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
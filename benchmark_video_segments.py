@@ -0,0 +1,62 @@
+"""
+Benchmark segmented video processing
+
+Reverses a locally generated test clip with different segment counts and
+reports wall time and peak ffmpeg memory for each. Every configuration runs
+in a fresh interpreter so peak RSS of its ffmpeg children is measured alone.
+
+Usage:
+    python benchmark_video_segments.py [--duration 60] [--segments 1,2,4,8] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmark_video_profiles import make_clip
+
+_WORKER = """
+import json, resource, sys
+from backend import video_processing
+source, output, segments, profile = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4]
+elapsed = video_processing.process(source, output, "reverse", profile=profile, segments=segments)
+peak_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+print(json.dumps({"wall_time_s": round(elapsed, 3), "peak_ffmpeg_rss_mb": round(peak_kb / 1024, 1)}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=int, default=60, help="clip length in seconds")
+    parser.add_argument("--size", default="1280x720", help="clip resolution")
+    parser.add_argument("--segments", default="1,2,4,8", help="comma-separated segment counts")
+    parser.add_argument("--profile", default="fast")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.mp4")
+        make_clip(source, args.duration, args.size)
+        for count in [int(n) for n in args.segments.split(",")]:
+            output = os.path.join(tmp, f"reverse_{count}.mp4")
+            out = subprocess.run(
+                [sys.executable, "-c", _WORKER, source, output, str(count), args.profile],
+                check=True, capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            result = {"segments": count, **json.loads(out.stdout.strip().splitlines()[-1])}
+            results.append(result)
+            print(f"segments={count:<3} wall={result['wall_time_s']:>7.2f}s  peak ffmpeg RSS={result['peak_ffmpeg_rss_mb']:>7.1f} MB")
+
+    print(f"({os.cpu_count()} CPU cores)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
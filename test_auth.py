@@ -0,0 +1,126 @@
+"""
+Authentication tests
+Runs the auth router in-process against a throwaway SQLite database and
+checks that per-IP throttling keys on the real client address behind a
+trusted proxy, that password cost calibration is stable across restarts and
+that /metrics only answers its scrape token or an admin.
+Run with:
+    python -m pytest test_auth.py
+"""
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from backend import auth, database
+from backend.routers import auth as auth_router
+
+PROXY = ("10.1.2.3", 40000)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'auth.db'}"
+    engine = database.create_db_engine(url)
+    database.Base.metadata.create_all(bind=engine)
+    async_engine = database.create_async_db_engine(url)
+    sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def get_async_db():
+        async with sessions() as db:
+            yield db
+
+    # get_current_user opens its own session
+    monkeypatch.setattr(database, "AsyncSessionLocal", sessions)
+    monkeypatch.setattr(auth, "trusted_proxies", auth.parse_trusted_proxies("10.0.0.0/8,127.0.0.1"))
+    monkeypatch.setattr(auth, "login_throttle", auth.LoginThrottle(900))
+    monkeypatch.setattr(auth, "register_throttle", auth.LoginThrottle(900))
+    monkeypatch.setattr(auth, "LOGIN_MAX_FAILURES_PER_IP", 3)
+    monkeypatch.setattr(auth, "REGISTER_MAX_PER_IP", 2)
+
+    app = FastAPI()
+    app.include_router(auth_router.router, prefix="/api/auth")
+    app.dependency_overrides[database.get_async_db] = get_async_db
+    yield app
+    engine.dispose()
+
+
+def failed_login(client, i, forwarded_for=None):
+    headers = {"X-Forwarded-For": forwarded_for} if forwarded_for else {}
+    # A new account each time, so only the per-IP limit can trip
+    return client.post("/api/auth/token", json={"email": f"nobody{i}@example.com", "password": "wrong"},
+                       headers=headers).status_code
+
+
+def test_forwarded_clients_are_throttled_independently(app):
+    client = TestClient(app, client=PROXY)
+    assert [failed_login(client, i, "203.0.113.7") for i in range(4)] == [400, 400, 400, 429]
+    # Same proxy, different client: its own bucket
+    assert failed_login(client, 10, "198.51.100.9") == 400
+    # Hops added by our own proxies are skipped; the spoofable left end is ignored
+    assert failed_login(client, 11, "1.1.1.1, 198.51.100.9, 10.9.9.9") == 400
+    assert failed_login(client, 12, "9.9.9.9, 203.0.113.7") == 429
+
+
+def test_register_limit_is_per_forwarded_client(app):
+    client = TestClient(app, client=PROXY)
+
+    def register(i, ip):
+        return client.post("/api/auth/register", headers={"X-Forwarded-For": ip},
+                           json={"username": f"user{i}", "email": f"user{i}@example.com", "password": "pw"}).status_code
+
+    assert [register(i, "203.0.113.7") for i in range(3)] == [200, 200, 429]
+    assert register(3, "198.51.100.9") == 200
+
+
+def test_untrusted_peer_cannot_pick_its_address(app):
+    client = TestClient(app, client=("203.0.113.50", 40000))
+    statuses = [failed_login(client, i, f"198.51.100.{i}") for i in range(4)]
+    assert statuses == [400, 400, 400, 429]
+
+
+def test_similar_calibrations_do_not_force_rehashes(monkeypatch):
+    monkeypatch.setattr(auth, "pwd_context", auth.pwd_context)
+    sample = auth.PASSWORD_MIN_ROUNDS
+
+    def calibrate(seconds_per_sample):
+        monkeypatch.setattr(auth, "_time_hash", lambda rounds: seconds_per_sample)
+        return auth.calibrate_password_cost(target_ms=50)
+
+    # A restart on the same machine times the sample hash a little differently
+    first = calibrate(0.010)
+    assert first % auth.PASSWORD_ROUNDS_STEP == 0
+    stored = auth.get_password_hash("pw")
+    for timing in (0.0085, 0.0095, 0.0105, 0.012):
+        calibrate(timing)
+        assert not auth.pwd_context.needs_update(stored)
+    # A much faster machine does raise the floor
+    calibrate(0.003)
+    assert auth.pwd_context.needs_update(stored)
+
+
+def test_metrics_need_scrape_token_or_admin(app, monkeypatch):
+    monkeypatch.setattr(auth, "METRICS_TOKEN", "scrape-secret")
+    monkeypatch.setattr(auth, "ADMIN_USERS", {"root"})
+    monkeypatch.setattr(auth, "principal_cache", auth.PrincipalCache(16, 60))
+
+    @app.get("/metrics")
+    def metrics_route(reader=Depends(auth.get_metrics_reader)):
+        return "ok"
+
+    client = TestClient(app, client=PROXY)
+    tokens = {}
+    for name in ("root", "someone"):
+        client.post("/api/auth/register", json={"username": name, "email": f"{name}@example.com", "password": "pw"})
+        tokens[name] = client.post("/api/auth/token", json={"email": f"{name}@example.com", "password": "pw"}).json()["access_token"]
+
+    def scrape(token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        return client.get("/metrics", headers=headers).status_code
+
+    assert scrape() == 401
+    assert scrape("wrong-secret") == 401
+    assert scrape(tokens["someone"]) == 403
+    assert scrape("scrape-secret") == 200
+    assert scrape(tokens["root"]) == 200
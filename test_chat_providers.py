@@ -0,0 +1,157 @@
+"""
+Chat provider tests
+Runs the Ollama provider against a local fake Ollama server (/api/tags and
+/api/chat) and checks routing by model name, the model-list TTL cache and
+that requests reuse pooled keep-alive connections. Run with:
+    python -m pytest test_chat_providers.py
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from backend.chat_providers import (  # noqa: E402
+    DEFAULT_GEMINI_MODEL, ChatProviders, GeminiProvider, OllamaProvider,
+)
+
+
+class FakeOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, models):
+        super().__init__(("127.0.0.1", 0), FakeOllamaHandler)
+        self.models = models
+        self.connections = 0
+        self.hits = {"/api/tags": 0, "/api/chat": 0}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.hits["/api/tags"] += 1
+        self._reply({"models": [{"name": name} for name in self.server.models]})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.hits["/api/chat"] += 1
+        # Like Ollama, a bare name means the :latest tag
+        if request["model"] not in self.server.models and f"{request['model']}:latest" not in self.server.models:
+            self._reply({"error": f"model '{request['model']}' not found"}, status=404)
+            return
+        prompt = request["messages"][-1]["content"]
+        self._reply({"model": request["model"], "done": True,
+                     "message": {"role": "assistant", "content": f"{request['model']} says: {prompt}"}})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_ollama():
+    server = FakeOllama(["mistral:latest", "llama3.2:1b"])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(coro_factory):
+    """Run against fresh providers; the pooled client belongs to one event loop"""
+    return asyncio.run(coro_factory())
+
+
+def test_generate_reuses_pooled_connection(fake_ollama):
+    async def scenario():
+        ollama = OllamaProvider(fake_ollama.url)
+        try:
+            replies = [await ollama.generate("mistral:latest", f"hi {i}") for i in range(5)]
+        finally:
+            await ollama.aclose()
+        return replies
+
+    replies = run(scenario)
+    assert replies[0] == "mistral:latest says: hi 0"
+    assert fake_ollama.hits["/api/chat"] == 5
+    assert fake_ollama.connections == 1
+
+
+def test_model_list_is_cached_until_ttl_expires(fake_ollama):
+    async def scenario(ttl):
+        ollama = OllamaProvider(fake_ollama.url, model_list_ttl=ttl)
+        try:
+            first = await ollama.list_models()
+            await asyncio.gather(*(ollama.list_models() for _ in range(10)))
+            return first
+        finally:
+            await ollama.aclose()
+
+    assert run(lambda: scenario(60)) == ["mistral:latest", "llama3.2:1b"]
+    assert fake_ollama.hits["/api/tags"] == 1
+    run(lambda: scenario(0))
+    assert fake_ollama.hits["/api/tags"] == 1 + 11
+
+
+def test_routing_by_model_name(fake_ollama):
+    async def scenario():
+        providers = ChatProviders(GeminiProvider(), OllamaProvider(fake_ollama.url))
+        try:
+            return {model: tuple(getattr(x, "name", x) for x in await providers.resolve(model))
+                    for model in ("mistral", "llama3.2:1b", "ollama/phi3", "gemini-2.5-pro",
+                                  "gemini-pro", "unknown-model", "string", "")}
+        finally:
+            await providers.aclose()
+
+    routes = run(scenario)
+    assert routes["mistral"] == ("ollama", "mistral")
+    assert routes["llama3.2:1b"] == ("ollama", "llama3.2:1b")
+    assert routes["ollama/phi3"] == ("ollama", "phi3")
+    assert routes["gemini-2.5-pro"] == ("gemini", "gemini-2.5-pro")
+    assert routes["gemini-pro"] == ("gemini", DEFAULT_GEMINI_MODEL)
+    assert routes["unknown-model"] == ("gemini", DEFAULT_GEMINI_MODEL)
+    assert routes["string"] == routes[""] == ("gemini", DEFAULT_GEMINI_MODEL)
+
+
+def test_unreachable_server_falls_back_to_gemini():
+    async def scenario():
+        providers = ChatProviders(GeminiProvider(), OllamaProvider("http://127.0.0.1:9", model_list_ttl=60))
+        try:
+            return await providers.resolve("mistral"), await providers.ollama.list_models()
+        finally:
+            await providers.aclose()
+
+    (provider, model), models = run(scenario)
+    assert (provider.name, model) == ("gemini", DEFAULT_GEMINI_MODEL)
+    assert models == []
+
+
+def test_sync_ping_uses_shared_client(fake_ollama):
+    ollama = OllamaProvider(fake_ollama.url)
+    try:
+        assert ollama.ping() and ollama.ping()
+    finally:
+        asyncio.run(ollama.aclose())
+    assert fake_ollama.connections == 1
+    assert not OllamaProvider("http://127.0.0.1:9").ping()
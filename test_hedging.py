@@ -0,0 +1,132 @@
+"""
+Hedged chat request tests
+Runs the HedgingRouter against stub providers with fixed per-model latencies
+and checks that the first answer wins, failed primaries fail over, hedges stay
+within the budget, losers are cancelled and only completed calls shape the
+latency stats. Run with:
+    python -m pytest test_hedging.py
+"""
+
+import asyncio
+
+import pytest
+
+from backend.hedging import HedgingRouter
+
+
+class StubProvider:
+    """Answers after a fixed delay per model, or raises for models set to an exception"""
+
+    name = "stub"
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.calls = []
+        self.cancelled = []
+
+    async def generate(self, model, prompt):
+        self.calls.append(model)
+        behaviour = self.behaviour[model]
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        try:
+            await asyncio.sleep(behaviour)
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        return f"{model}: {prompt}"
+
+
+class StubProviders:
+    def __init__(self, provider):
+        self.provider = provider
+
+    def get(self, name):
+        return self.provider
+
+
+def make_router(behaviour, budget=1.0, delay=0.05):
+    provider = StubProvider(behaviour)
+    router = HedgingRouter(StubProviders(provider), ["stub/a", "stub/b"], budget=budget,
+                           default_delay=delay, min_delay=0.0, max_delay=delay)
+    return router, provider
+
+
+def test_fast_primary_is_not_hedged():
+    router, provider = make_router({"a": 0.01, "b": 0.01})
+    assert asyncio.run(router.generate("stub", "a", "hi")) == "a: hi"
+    assert provider.calls == ["a"]
+    assert router.stats_for("stub", "a").ewma_latency == pytest.approx(0.01, abs=0.02)
+
+
+def test_slow_primary_is_hedged_and_loser_cancelled():
+    router, provider = make_router({"a": 5.0, "b": 0.01})
+    assert asyncio.run(router.generate("stub", "a", "hi")) == "b: hi"
+    assert provider.calls == ["a", "b"]
+    assert provider.cancelled == ["a"]
+
+
+def test_failed_primary_fails_over_without_budget():
+    router, provider = make_router({"a": RuntimeError("down"), "b": 0.01}, budget=0.0)
+    router._tokens = 0.0
+    assert asyncio.run(router.generate("stub", "a", "hi")) == "b: hi"
+    assert router.stats_for("stub", "a").error_rate > 0
+    assert router.stats_for("stub", "a").ewma_latency is None
+
+
+def test_both_failing_raises_first_error():
+    router, _ = make_router({"a": RuntimeError("a down"), "b": RuntimeError("b down")})
+    with pytest.raises(RuntimeError, match="a down"):
+        asyncio.run(router.generate("stub", "a", "hi"))
+
+
+def test_hedges_stop_when_budget_is_spent():
+    router, provider = make_router({"a": 0.15, "b": 5.0}, budget=0.0)
+
+    async def scenario():
+        return [await router.generate("stub", "a", f"hi {i}") for i in range(3)]
+
+    assert asyncio.run(scenario()) == ["a: hi 0", "a: hi 1", "a: hi 2"]
+    # The starting token pays for one hedge, after that the slow primary is just awaited
+    assert provider.calls.count("b") == 1
+    assert provider.cancelled == ["b"]
+
+
+def test_cancelled_backup_does_not_look_fast():
+    # The primary wins every race, so the slow backup is always cut short
+    router, provider = make_router({"a": 0.1, "b": 5.0}, budget=1.0, delay=0.02)
+
+    async def scenario():
+        for i in range(5):
+            await router.generate("stub", "a", f"hi {i}")
+
+    asyncio.run(scenario())
+    assert provider.cancelled == ["b"] * 5
+    backup = router.stats_for("stub", "b")
+    assert backup.ewma_latency is None
+    assert not backup.latencies and not backup.censored
+    assert router.stats_for("stub", "a").ewma_latency == pytest.approx(0.1, abs=0.05)
+
+
+def test_cancelled_primary_only_counts_as_a_lower_bound():
+    router, _ = make_router({"a": 5.0, "b": 0.05}, budget=1.0, delay=0.02)
+    asyncio.run(router.generate("stub", "a", "hi"))
+    primary = router.stats_for("stub", "a")
+    assert primary.ewma_latency is None and not primary.latencies
+    assert len(primary.censored) == 1 and primary.censored[0] >= 0.05
+    assert primary.error_rate == 0
+
+
+def test_caller_cancellation_cancels_every_call():
+    router, provider = make_router({"a": 5.0, "b": 5.0}, delay=0.01)
+
+    async def scenario():
+        task = asyncio.ensure_future(router.generate("stub", "a", "hi"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert sorted(provider.cancelled) == ["a", "b"]
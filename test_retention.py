@@ -0,0 +1,106 @@
+"""
+Chat retention tests
+Archives old messages from a throwaway SQLite database and checks that each
+user-month ends up in a single segment across repeated runs, and that paged
+history reads cross from the hot table into the archive correctly. Run with:
+    python -m pytest test_retention.py
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from backend import models, retention
+from backend.database import Base, create_db_engine
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'retention.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    for name in ("alice", "bob"):
+        session.add(models.User(username=name, email=f"{name}@example.com", hashed_password="x"))
+    session.commit()
+    # Archive ids restart in every test database
+    retention.segment_cache.clear()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def add_messages(db, user_id, timestamps):
+    rows = [models.ChatHistory(user_id=user_id, message=f"message at {ts:%Y-%m-%d %H:%M}", role="user",
+                               timestamp=ts) for ts in timestamps]
+    db.add_all(rows)
+    db.commit()
+    return [r.id for r in rows]
+
+
+def segments(db):
+    return sorted((a.user_id, a.month, a.message_count) for a in db.query(models.ChatArchive))
+
+
+def test_repeated_runs_keep_one_segment_per_user_month(db):
+    now = datetime.utcnow()
+    old_month = (now - timedelta(days=200)).replace(day=10, hour=12)
+    add_messages(db, 1, [old_month + timedelta(hours=h) for h in range(5)])
+    add_messages(db, 2, [old_month + timedelta(hours=h) for h in range(3)])
+    # Small batches split a user-month across several transactions too
+    assert retention.archive_old_chats(db, older_than_days=90, batch_size=2) == 8
+
+    add_messages(db, 1, [old_month + timedelta(days=1, hours=h) for h in range(4)])
+    add_messages(db, 1, [now - timedelta(days=1)])
+    assert retention.archive_old_chats(db, older_than_days=90, batch_size=3) == 4
+
+    month = old_month.strftime("%Y-%m")
+    assert segments(db) == [(1, month, 9), (2, month, 3)]
+    assert db.query(models.ChatHistory).count() == 1
+    archive = db.query(models.ChatArchive).filter_by(user_id=1).one()
+    ids = [m["id"] for m in retention.segment_cache.get(archive)]
+    assert ids == sorted(ids) and (archive.first_id, archive.last_id) == (ids[0], ids[-1])
+
+
+def test_paging_crosses_from_hot_table_into_archive(db):
+    now = datetime.utcnow()
+    old = [now - timedelta(days=200 - d) for d in range(6)]
+    archived_ids = add_messages(db, 1, old)
+    add_messages(db, 2, old[:2])
+    retention.archive_old_chats(db, older_than_days=90)
+    hot_ids = add_messages(db, 1, [now - timedelta(minutes=10 - m) for m in range(4)])
+    all_ids = archived_ids + hot_ids
+
+    pages, before_id = [], None
+    while True:
+        page = retention.read_history(db, 1, limit=3, before_id=before_id)
+        if not page:
+            break
+        pages.append([m["id"] for m in page])
+        before_id = page[0]["id"]
+    assert pages == [all_ids[7:10], all_ids[4:7], all_ids[1:4], all_ids[0:1]]
+    # The page that straddles the boundary mixes the last hot row with archived ones
+    assert pages[1][-1] == hot_ids[0] and pages[1][0] in archived_ids
+
+    assert [m["id"] for m in retention.read_history(db, 1)] == all_ids
+    assert all(m["user_id"] == 1 for m in retention.read_history(db, 1, limit=10))
+
+
+def test_full_page_of_hot_rows_skips_the_archive(db, monkeypatch):
+    now = datetime.utcnow()
+    add_messages(db, 1, [now - timedelta(days=200)])
+    retention.archive_old_chats(db, older_than_days=90)
+    hot_ids = add_messages(db, 1, [now - timedelta(minutes=5 - m) for m in range(5)])
+
+    def fail(archive):
+        raise AssertionError("archive segment decompressed for a page the hot table fills")
+
+    monkeypatch.setattr(retention.segment_cache, "get", fail)
+    assert [m["id"] for m in retention.read_history(db, 1, limit=5)] == hot_ids
+
+
+def test_archiving_needs_an_explicit_retention_period(db):
+    add_messages(db, 1, [datetime.utcnow() - timedelta(days=400)])
+    with pytest.raises(ValueError):
+        retention.archive_old_chats(db, older_than_days=0)
+    assert db.query(models.ChatHistory).count() == 1
@@ -0,0 +1,170 @@
+"""
+Fair scheduling and compute quota tests
+Drives JobQueue from threads the way the request threadpool does and checks
+weighted fair ordering across users, the per-user running and queued caps,
+the wait deadline and ComputeQuota's reset time and Retry-After. Run with:
+    python -m pytest test_scheduler.py
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from backend import scheduler
+from backend.scheduler import ComputeQuota, JobQueue
+
+ALICE = SimpleNamespace(id=1, username="alice")
+BOB = SimpleNamespace(id=2, username="bob")
+CAROL = SimpleNamespace(id=3, username="carol")
+
+
+def make_queue(slots=1, **kwargs):
+    options = {"quota": None, "max_running_per_user": 10, "max_queued_per_user": 10, "max_wait": 5}
+    options.update(kwargs)
+    return JobQueue("test", slots, **options)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def start_job(queue, user, order, hold=None, errors=None, check_quota=True):
+    """Acquire in a thread, record the grant order, then release (after `hold` is set, if given)"""
+    def run():
+        try:
+            ticket = queue.acquire(user, check_quota=check_quota)
+        except HTTPException as e:
+            errors.append(e)
+            return
+        order.append(user.username)
+        if hold is not None:
+            hold.wait(5)
+        queue.release(ticket)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_new_user_is_not_stuck_behind_a_backlog():
+    queue = make_queue()
+    blocker = queue.acquire(CAROL)
+    order, threads = [], []
+    for user in (ALICE, ALICE, ALICE, BOB):
+        threads.append(start_job(queue, user, order))
+        wait_until(lambda: queue.queued() == len(threads))
+
+    queue.release(blocker)
+    for thread in threads:
+        thread.join(5)
+    # Bob's first job goes ahead of Alice's second and third, not after them
+    assert order == ["alice", "bob", "alice", "alice"]
+
+
+def test_running_jobs_are_capped_per_user():
+    queue = make_queue(slots=2, max_running_per_user=1)
+    first = queue.acquire(ALICE)
+    order, hold = [], threading.Event()
+    alice_second = start_job(queue, ALICE, order, hold=hold)
+    wait_until(lambda: queue.queued() == 1)
+
+    # A slot is free but Alice is at her cap, so only Bob gets in
+    bob = queue.acquire(BOB)
+    time.sleep(0.05)
+    assert order == [] and queue.running == 2
+
+    queue.release(first)
+    wait_until(lambda: order == ["alice"])
+    hold.set()
+    alice_second.join(5)
+    queue.release(bob)
+    assert queue.running == 0 and queue.queued() == 0
+
+
+def test_queued_jobs_per_user_are_limited():
+    queue = make_queue(max_queued_per_user=1)
+    blocker = queue.acquire(CAROL)
+    order, errors = [], []
+    waiting = start_job(queue, ALICE, order, errors=errors)
+    wait_until(lambda: queue.queued() == 1)
+
+    with pytest.raises(HTTPException) as excinfo:
+        queue.acquire(ALICE)
+    assert excinfo.value.status_code == 429
+    assert int(excinfo.value.headers["Retry-After"]) >= 1
+
+    # Work that was already accepted is queued anyway
+    accepted = start_job(queue, ALICE, order, errors=errors, check_quota=False)
+    wait_until(lambda: queue.queued() == 2)
+    queue.release(blocker)
+    waiting.join(5)
+    accepted.join(5)
+    assert order == ["alice", "alice"] and errors == []
+
+
+def test_wait_deadline_only_applies_to_refusable_jobs():
+    queue = make_queue(max_wait=0.1)
+    blocker = queue.acquire(CAROL)
+    with pytest.raises(HTTPException) as excinfo:
+        queue.acquire(ALICE)
+    assert excinfo.value.status_code == 503
+    assert queue.queued() == 0
+
+    order, errors = [], []
+    background = start_job(queue, ALICE, order, errors=errors, check_quota=False)
+    time.sleep(0.3)
+    assert order == [] and errors == []
+    queue.release(blocker)
+    background.join(5)
+    assert order == ["alice"]
+
+
+def test_release_charges_the_quota():
+    quota = ComputeQuota(60, 3600)
+    queue = make_queue(quota=quota)
+    ticket = queue.acquire(ALICE)
+    time.sleep(0.05)
+    elapsed = queue.release(ticket)
+    assert quota.used(ALICE) == pytest.approx(elapsed) and elapsed >= 0.05
+    assert quota.used(BOB) == 0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(scheduler.time, "time", lambda: now[0])
+    return now
+
+
+def test_quota_reset_time_and_retry_after(clock):
+    quota = ComputeQuota(10, 100, overrides={"bob": 0})
+    started = clock[0]
+    quota.charge(ALICE, 6)
+    clock[0] += 30
+    quota.charge(ALICE, 6)
+    quota.check(BOB)
+    quota.charge(BOB, 1000)
+    quota.check(BOB)  # 0 = unlimited
+
+    clock[0] += 10
+    # Back under quota once the first charge leaves the window
+    assert quota.reset_at(ALICE) == started + 100
+    with pytest.raises(HTTPException) as excinfo:
+        quota.check(ALICE)
+    error = excinfo.value
+    assert error.status_code == 429
+    assert error.headers["Retry-After"] == "61"
+    reset_iso = datetime.fromtimestamp(started + 100, timezone.utc).isoformat(timespec="seconds")
+    assert error.headers["X-Quota-Reset"] == reset_iso
+    assert reset_iso in error.detail and "10s" in error.detail
+
+    clock[0] = started + 100
+    assert quota.reset_at(ALICE) is None
+    assert quota.used(ALICE) == 6
@@ -0,0 +1,130 @@
+"""
+Chat search tests
+Builds the SQLite FTS5 index in a throwaway database and checks ranking,
+highlighted snippets, pagination, per-user isolation, trigger sync on
+insert/update/delete, archived messages staying searchable and the backfill
+after rebuilding an older index. Run with:
+    python -m pytest test_search.py
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from backend import models, retention, search
+from backend.database import Base, create_db_engine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for user_id, name in ((1, "alice"), (2, "bob")):
+            conn.execute(text("INSERT INTO users (id, username, email, hashed_password) VALUES (:id, :n, :e, 'x')"),
+                         {"id": user_id, "n": name, "e": f"{name}@example.com"})
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    search.setup_search_index(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def add(db, user_id, *messages):
+    rows = [models.ChatHistory(user_id=user_id, message=m, role="user") for m in messages]
+    db.add_all(rows)
+    db.commit()
+    return [r.id for r in rows]
+
+
+def ids(hits):
+    return [h["id"] for h in hits]
+
+
+def test_ranking_and_snippets(db):
+    weak, strong, _ = add(db, 1,
+                          "a long message that mentions python once among many other unrelated words here",
+                          "python python python",
+                          "nothing relevant")
+    hits = search.search_messages(db, 1, "python")
+    assert ids(hits) == [strong, weak]
+    assert hits[0]["rank"] <= hits[1]["rank"]
+    assert "<mark>python</mark>" in hits[1]["snippet"]
+    # Porter stemming: "running" matches "runs"
+    (run,) = add(db, 1, "she runs every morning")
+    assert ids(search.search_messages(db, 1, "running")) == [run]
+
+
+def test_other_users_messages_are_never_returned(db):
+    (mine,) = add(db, 1, "shared topic: databases")
+    add(db, 2, *["databases databases databases"] * 5)
+    # A message that merely mentions another user's id doesn't leak either
+    add(db, 2, "user 1 talks about databases")
+    assert ids(search.search_messages(db, 1, "databases")) == [mine]
+    assert len(search.search_messages(db, 2, "databases")) == 6
+
+
+def test_pagination(db):
+    rows = add(db, 1, *[f"note {i} about caching" for i in range(7)])
+    pages = [ids(search.search_messages(db, 1, "caching", limit=3, offset=o)) for o in (0, 3, 6)]
+    assert [len(p) for p in pages] == [3, 3, 1]
+    assert sorted(sum(pages, [])) == rows
+
+
+def test_triggers_keep_index_in_sync(db):
+    (row_id,) = add(db, 1, "draft about kittens")
+    row = db.get(models.ChatHistory, row_id)
+    row.message = "final about puppies"
+    db.commit()
+    assert search.search_messages(db, 1, "kittens") == []
+    assert ids(search.search_messages(db, 1, "puppies")) == [row_id]
+
+    db.delete(row)
+    db.commit()
+    assert search.search_messages(db, 1, "puppies") == []
+
+
+def test_archived_messages_are_still_found(db):
+    old = datetime.utcnow() - timedelta(days=200)
+    db.add(models.ChatHistory(id=1, user_id=1, message="notes on the lighthouse trip", role="assistant", timestamp=old))
+    db.commit()
+    (hot,) = add(db, 1, "planning another lighthouse visit")
+    retention.segment_cache.clear()
+    assert retention.archive_old_chats(db, older_than_days=90) == 1
+    assert db.get(models.ChatHistory, 1) is None
+
+    hits = retention.fill_archived_hits(db, 1, search.search_messages(db, 1, "lighthouse"))
+    assert sorted(ids(hits)) == [1, hot]
+    (archived,) = [h for h in hits if h["archived"]]
+    assert archived["id"] == 1 and archived["role"] == "assistant" and archived["timestamp"] == old
+    assert "<mark>lighthouse</mark>" in archived["snippet"]
+    assert search.search_messages(db, 2, "lighthouse") == []
+
+
+def test_query_syntax_is_not_injected(db):
+    (row_id,) = add(db, 1, "user_id is a column name")
+    assert ids(search.search_messages(db, 1, 'column" OR user_id : "2')) == []
+    assert ids(search.search_messages(db, 1, "column NEAR name")) == []
+    assert ids(search.search_messages(db, 1, "column name")) == [row_id]
+    assert search.search_messages(db, 1, "***") == []
+
+
+def test_old_unindexed_layout_is_rebuilt_and_backfilled(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE VIRTUAL TABLE {search.FTS_TABLE} USING fts5(message, user_id UNINDEXED)"))
+    session = sessionmaker(bind=engine)()
+    existing = add(session, 1, "written before the rebuild")
+
+    search.setup_search_index(engine)
+    assert search.search_messages(session, 1, "rebuild") == []
+    assert search.backfill(engine) == 1
+    (later,) = add(session, 1, "written after the rebuild")
+    assert sorted(ids(search.search_messages(session, 1, "rebuild"))) == existing + [later]
+    session.close()
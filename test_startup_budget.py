@@ -0,0 +1,57 @@
+"""
+Startup budget regression test
+
+Imports backend.main in a fresh interpreter and checks that it stays within
+an import-time and RSS budget, loads none of the heavy ML libraries and does
+not touch the database. Run with:
+    python -m pytest test_startup_budget.py
+Budgets can be raised on slow machines with STARTUP_BUDGET_SECONDS and
+STARTUP_BUDGET_RSS_MB.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPORT_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "3.0"))
+RSS_BUDGET_MB = float(os.getenv("STARTUP_BUDGET_RSS_MB", "200"))
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "google.generativeai")
+
+PROBE = f"""
+import json, resource, sys, time
+sys.path.insert(0, {BASE_DIR!r})
+started = time.perf_counter()
+import backend.main
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure_import(workdir):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}")
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_stays_within_budget(tmp_path):
+    # Best of two, so a cold disk cache doesn't fail the run
+    runs = [measure_import(str(tmp_path)) for _ in range(2)]
+    fastest = min(runs, key=lambda r: r["seconds"])
+    assert fastest["seconds"] < IMPORT_BUDGET_SECONDS, f"import backend.main took {fastest['seconds']:.2f}s"
+    assert fastest["rss_mb"] < RSS_BUDGET_MB, f"import backend.main used {fastest['rss_mb']:.0f} MB RSS"
+
+
+def test_import_loads_no_heavy_modules(tmp_path):
+    assert measure_import(str(tmp_path))["heavy"] == []
+
+
+def test_import_does_not_touch_database(tmp_path):
+    measure_import(str(tmp_path))
+    assert not (tmp_path / "startup.db").exists()
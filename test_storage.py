@@ -0,0 +1,126 @@
+"""
+Media storage backend tests
+The S3 backend runs against moto's standalone server, a local S3-compatible
+endpoint standing in for MinIO, so presigned URLs are fetched over real HTTP.
+Run with:
+    python -m pytest test_storage.py
+"""
+
+import os
+import socket
+
+import pytest
+
+pytest.importorskip("boto3")
+moto_server = pytest.importorskip("moto.server")
+httpx = pytest.importorskip("httpx")
+
+from backend import storage as storage_module  # noqa: E402
+from backend.storage import LocalStorage, S3Storage  # noqa: E402
+
+BUCKET = "nova-media"
+
+
+@pytest.fixture(scope="module")
+def endpoint():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3(endpoint, monkeypatch, tmp_path):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.chdir(tmp_path)
+    backend = S3Storage(BUCKET, endpoint_url=endpoint, region="us-east-1", prefix="media")
+    backend.client.create_bucket(Bucket=BUCKET)
+    yield backend
+    for page in backend.client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET):
+        for item in page.get("Contents", []):
+            backend.client.delete_object(Bucket=BUCKET, Key=item["Key"])
+    backend.client.delete_bucket(Bucket=BUCKET)
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_put_publishes_with_content_type_and_immutable_caching(s3):
+    path = write("static/generated_images/1_cat_abcd1234.webp", b"RIFF....WEBP")
+    s3.put(path)
+    head = s3.client.head_object(Bucket=BUCKET, Key="media/generated_images/1_cat_abcd1234.webp")
+    assert head["ContentType"] == "image/webp"
+    assert head["CacheControl"] == storage_module.MEDIA_CACHE_CONTROL
+
+
+def test_presigned_url_downloads_directly_from_bucket(s3, endpoint):
+    path = write("static/processed/abc.mp4", b"video bytes")
+    s3.put(path)
+    url = s3.url(path)
+    assert url.startswith(f"{endpoint}/{BUCKET}/media/processed/abc.mp4?")
+    assert "X-Amz-Signature=" in url
+    response = httpx.get(url)
+    assert response.status_code == 200
+    assert response.content == b"video bytes"
+
+
+def test_public_base_url_skips_signing(s3):
+    s3.public_base_url = "https://cdn.example.com"
+    assert s3.url("static/processed/abc.mp4") == "https://cdn.example.com/media/processed/abc.mp4"
+
+
+def test_hls_playlist_falls_back_to_app_without_public_base_url(s3):
+    assert s3.url("static/processed/hls/abc/master.m3u8") == "/static/processed/hls/abc/master.m3u8"
+
+
+def test_exists_and_ensure_local_fetch_media_from_another_node(s3):
+    path = write("static/uploads/clip.mp4", b"uploaded")
+    s3.put(path)
+    os.remove(path)
+    assert s3.exists(path)
+    assert s3.ensure_local(path) == path
+    with open(path, "rb") as f:
+        assert f.read() == b"uploaded"
+    with pytest.raises(FileNotFoundError):
+        s3.ensure_local("static/uploads/missing.mp4")
+    assert not s3.exists("static/uploads/missing.mp4")
+
+
+def test_open_streams_remote_object(s3):
+    path = write("static/generated_images/remote.png", b"\x89PNG")
+    s3.put(path)
+    os.remove(path)
+    with s3.open(path) as f:
+        assert f.read() == b"\x89PNG"
+
+
+def test_delete_and_delete_dir_remove_local_and_remote_copies(s3):
+    video = s3.put(write("static/processed/abc.mp4", b"v"))
+    hls_dir = "static/processed/hls/abc"
+    write(f"{hls_dir}/master.m3u8", b"#EXTM3U")
+    write(f"{hls_dir}/v0/seg_000.ts", b"ts")
+    s3.put_dir(hls_dir)
+
+    s3.delete_dir(hls_dir)
+    s3.delete(video)
+    assert not os.path.exists(hls_dir) and not os.path.exists(video)
+    assert s3.client.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
+
+
+def test_local_backend_serves_through_static_mount(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    local = LocalStorage()
+    path = write("static/generated_images/a.webp", b"img")
+    assert local.put(path) == path
+    assert local.url(path) == "/static/generated_images/a.webp"
+    assert local.ensure_local(path) == path
+    assert local.delete(path) and not local.exists(path)
+    assert not local.delete(path)
@@ -0,0 +1,141 @@
+"""
+Video cache tests
+Runs lookups, claims and releases of cached outputs against a throwaway
+SQLite database and output directory, including a claim racing a release
+of the same output. Run with:
+    python -m pytest test_video_cache.py
+"""
+
+import os
+import threading
+import time
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from backend import models, video_cache
+from backend.database import Base, create_db_engine
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(video_cache, "PROCESSED_DIR", str(tmp_path / "processed"))
+    monkeypatch.setattr(video_cache, "HLS_DIR", str(tmp_path / "processed" / "hls"))
+    monkeypatch.setattr(video_cache, "PREVIEW_DIR", str(tmp_path / "previews"))
+    os.makedirs(video_cache.PROCESSED_DIR)
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'video.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def add_task(db, output=None, source_hash="abc"):
+    task = models.VideoTask(prompt="sepia", source_video="static/uploads/in.mp4",
+                            source_hash=source_hash, output_video=output)
+    db.add(task)
+    db.commit()
+    return task
+
+
+def write_output(key="k1", data=b"video"):
+    path = video_cache.output_path_for(key, "in.mp4")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_lookup_hit_and_miss(sessions):
+    assert video_cache.lookup("k1", "in.mp4") is None
+    # A crashed writer's empty file is not a hit
+    write_output("k1", b"")
+    assert video_cache.lookup("k1", "in.mp4") is None
+    path = write_output("k1")
+    assert video_cache.lookup("k1", "in.mp4") == path
+    assert video_cache.lookup("k2", "in.mp4") is None
+
+
+def test_claim_and_release(sessions):
+    db = sessions()
+    path = write_output()
+    first, second = add_task(db), add_task(db)
+    assert video_cache.claim(db, first, path)
+    assert video_cache.claim(db, second, path)
+    assert video_cache.ref_count(db, path) == 2
+
+    db.delete(first)
+    db.commit()
+    assert not video_cache.release(db, path)
+    assert os.path.exists(path)
+
+    db.delete(second)
+    db.commit()
+    assert video_cache.release(db, path)
+    assert not os.path.exists(path)
+    # The output is gone, so a later claim has to produce it again
+    assert not video_cache.claim(db, add_task(db), path)
+    db.close()
+
+
+def test_deleting_the_source_task_keeps_a_claimed_output(sessions):
+    db = sessions()
+    path = write_output()
+    source = add_task(db, output=path)
+    reuser = add_task(db)
+    preview = video_cache.preview_path_for("abc", "p1")
+    os.makedirs(os.path.dirname(preview))
+    open(preview, "wb").close()
+    assert video_cache.claim(db, reuser, path)
+
+    db.delete(source)
+    db.commit()
+    assert not video_cache.release(db, path)
+    # The other task still uses the same upload, so its previews stay too
+    assert not video_cache.release_previews(db, "abc")
+    assert os.path.exists(path) and os.path.exists(preview)
+    assert db.get(models.VideoTask, reuser.id).output_video == path
+    db.close()
+
+
+def test_concurrent_claim_and_release(sessions, monkeypatch):
+    count = video_cache.ref_count
+
+    def slow_ref_count(db, path):
+        # Widen the window between counting references and deleting the file
+        result = count(db, path)
+        time.sleep(0.005)
+        return result
+
+    monkeypatch.setattr(video_cache, "ref_count", slow_ref_count)
+    for i in range(20):
+        setup = sessions()
+        path = write_output(f"race{i}")
+        owner_id = add_task(setup, output=path).id
+        claimer_id = add_task(setup).id
+        setup.close()
+
+        start = threading.Barrier(2)
+        claimed = []
+
+        def release():
+            db = sessions()
+            db.delete(db.get(models.VideoTask, owner_id))
+            db.commit()
+            start.wait()
+            video_cache.release(db, path)
+            db.close()
+
+        def claim():
+            db = sessions()
+            task = db.get(models.VideoTask, claimer_id)
+            start.wait()
+            claimed.append(video_cache.claim(db, task, path))
+            db.close()
+
+        threads = [threading.Thread(target=release), threading.Thread(target=claim)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Either the claim won and the file stays, or the release won and the claim says so
+        assert claimed == [os.path.exists(path)]
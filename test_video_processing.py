@@ -0,0 +1,43 @@
+"""
+Video processing tests
+Checks the prompt-to-filter mapping and segmented processing's fallback
+without running ffmpeg. Run with:
+    python -m pytest test_video_processing.py
+"""
+
+import pytest
+
+from backend import video_processing
+from backend.video_processing import prompt_to_filter
+
+POP = "eq=brightness=0.06:saturation=2"
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("trim the first 5 seconds", None),
+    ("Cut it down to the chorus", None),
+    ("cut, then stop", None),
+    # Words that merely contain "cut" or "trim" get the default look
+    ("make it look cute", POP),
+    ("execute a dramatic look", POP),
+    ("shortcut style", POP),
+    ("a trimmed-down vibe", POP),
+    ("black and white please", "hue=s=0"),
+    ("mirror it", "hflip"),
+])
+def test_prompt_to_filter(prompt, expected):
+    assert prompt_to_filter(prompt) == expected
+
+
+def test_segmented_falls_back_to_single_pass_without_segments(monkeypatch):
+    commands = []
+    monkeypatch.setattr(video_processing, "probe_duration", lambda path: 0.0)
+    monkeypatch.setattr(video_processing, "split_segments", lambda source, workdir, seconds: [])
+    monkeypatch.setattr(video_processing, "run_ffmpeg", commands.append)
+
+    video_processing.process_segmented("in.mp4", "out.mp4", "reverse", workers=4)
+    assert len(commands) == 1
+    command = commands[0]
+    assert command[command.index("-i") + 1] == "in.mp4"
+    assert command[command.index("-vf") + 1] == "reverse"
+    assert command[-1] == "out.mp4"